@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Benchmark LLM-output parsing in book_builder.py on a large synthetic response.
+
+Compares the original parser (a DOTALL regex for code blocks, re-run by
+parse_image_list, plus a second regex pass for [IMAGE: ...] markers, and a
+streaming tokenizer that re-sliced its buffer per block) with the single-pass
+CodeBlockStream, checks both give identical blocks and image lists, and
+prints the timings (best of --repeat).
+
+    python3 bench_llm_output.py                 # ~12 MB, 1000 blocks
+    python3 bench_llm_output.py --blocks 200 --fuzz 20000
+"""
+
+import argparse
+import json
+import random
+import re
+import time
+
+import book_builder
+from book_builder import CodeBlockStream, parse_code_blocks, parse_image_list
+
+WORDS = "the chapter figure data model signal noise result method light river".split()
+
+
+# ── the parser as it was, for comparison ─────────────────────────────────────
+
+def old_parse_code_blocks(text):
+    blocks = {}
+    for label, content in re.findall(r"```([^\n`]*)\n(.*?)```", text, re.DOTALL):
+        if label.strip():
+            blocks[label.strip()] = content
+    return blocks
+
+
+def old_parse_image_list(text):
+    blocks = old_parse_code_blocks(text)
+    if "images" in blocks:
+        try:
+            return json.loads(blocks["images"])
+        except json.JSONDecodeError:
+            pass
+    return [{"prompt": m.group(1), "filename": m.group(2)}
+            for m in re.finditer(r"\[IMAGE:\s*(.+?)\s*→\s*(\S+)\]", text)]
+
+
+class OldCodeBlockStream:
+    FENCE = "```"
+
+    def __init__(self, on_block):
+        self.on_block = on_block
+        self._buf, self._label, self._body = "", None, []
+
+    def feed(self, chunk):
+        self._buf += chunk
+        while True:
+            idx = self._buf.find(self.FENCE)
+            if self._label is None:
+                if idx < 0:
+                    self._buf = self._buf[-2:]
+                    return
+                nl = self._buf.find("\n", idx + 3)
+                if nl < 0:
+                    self._buf = self._buf[idx:]
+                    return
+                label = self._buf[idx + 3:nl]
+                if "`" in label:
+                    self._buf = self._buf[idx + 1:]
+                    continue
+                self._label, self._body, self._buf = label, [], self._buf[nl + 1:]
+            else:
+                if idx < 0:
+                    self._body.append(self._buf[:-2])
+                    self._buf = self._buf[-2:]
+                    return
+                self._body.append(self._buf[:idx])
+                label, content = self._label.strip(), "".join(self._body)
+                self._label, self._body, self._buf = None, [], self._buf[idx + 3:]
+                if label:
+                    self.on_block(label, content)
+
+
+# ── synthetic responses ──────────────────────────────────────────────────────
+
+def synthetic_response(n_blocks, rng, lines_per_block=200, with_json=True):
+    """A formatting response: prose, n_blocks labelled blocks with image markers, an images block."""
+    parts, images = [], []
+    for b in range(n_blocks):
+        body = []
+        for i in range(lines_per_block):
+            if i % 40 == 7:
+                name = f"ch{b:03d}_fig{i}"
+                prompt = " ".join(rng.choices(WORDS, k=8))
+                images.append({"filename": name, "prompt": prompt})
+                body.append(f"[IMAGE: {prompt} → {name}]")
+            else:
+                body.append(" ".join(rng.choices(WORDS, k=7)) + " `inline` code.")
+        parts.append(f"Notes on part {b}.\n\n```ch{b:03d}.qmd\n" + "\n".join(body) + "\n```\n")
+    if with_json:
+        parts.append("```images\n" + json.dumps(images, indent=1) + "\n```\n")
+    return "".join(parts)
+
+
+def fuzz_document(rng):
+    """Random mix of fences, labels, stray backticks and one-line markers."""
+    pieces = ["```", "```typst\n", "```images\n", "``", "`", "\n", "text ", "[IMAGE: a b → f1]",
+              "[IMAGE: x → y]\n", '[{"filename": "z", "prompt": "p"}]\n', "main.typ\n", " "]
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 40)))
+
+
+def chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--blocks", type=int, default=1000, help="Labelled code blocks in the response (default 1000)")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, best is reported (default 5)")
+    parser.add_argument("--chunk", type=int, default=40, help="Stream chunk size in characters (default 40)")
+    parser.add_argument("--fuzz", type=int, default=2000,
+                        help="Random documents to check old vs new on, with random chunking (default 2000)")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    text = synthetic_response(args.blocks, rng)
+    pieces = chunks(text, args.chunk)
+    print(f"{len(text) / 1e6:.1f} MB response, {args.blocks} blocks, "
+          f"{text.count('[IMAGE:')} markers, {len(pieces)} chunks of {args.chunk}")
+
+    def old_both():
+        return old_parse_code_blocks(text), old_parse_image_list(text)
+
+    def new_both():
+        scan = book_builder.scan_llm_output(text)
+        return scan.blocks, scan.images
+
+    def old_stream():
+        blocks = {}
+        stream = OldCodeBlockStream(blocks.__setitem__)
+        for piece in pieces:
+            stream.feed(piece)
+        return blocks, old_parse_image_list(text)
+
+    def new_stream():
+        stream = CodeBlockStream()
+        for piece in pieces:
+            stream.feed(piece)
+        stream.close()
+        return stream.blocks, stream.images
+
+    marker_text = synthetic_response(args.blocks, random.Random(7), with_json=False)
+    rows = [
+        ("blocks + images", old_both, new_both),
+        ("image list (markers only)", lambda: old_parse_image_list(marker_text), lambda: parse_image_list(marker_text)),
+        ("streamed + images", old_stream, new_stream),
+    ]
+    for name, old, new in rows:
+        t_old, r_old = best_of(args.repeat, old)
+        t_new, r_new = best_of(args.repeat, new)
+        assert r_old == r_new, f"{name}: CodeBlockStream output differs from the old parser"
+        print(f"  {name:<26} {t_old:7.0f} ms → {t_new:5.0f} ms  ({t_old / max(t_new, 1e-9):.1f}×)")
+
+    for _ in range(args.fuzz):
+        doc = fuzz_document(rng)
+        stream = CodeBlockStream()
+        for piece in chunks(doc, rng.randint(1, 8)):
+            stream.feed(piece)
+        stream.close()
+        assert stream.blocks == parse_code_blocks(doc) == old_parse_code_blocks(doc), repr(doc)
+        assert stream.images == parse_image_list(doc) == old_parse_image_list(doc), repr(doc)
+    print(f"  output identical on the synthetic response and {args.fuzz} random documents")
+
+
+if __name__ == "__main__":
+    main()
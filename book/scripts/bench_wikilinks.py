@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark wikilink resolution in build-html.py on a synthetic wiki.
+
+Compares the per-link linear scan build-html used to do (slugify every page
+title for every link) with LinkResolver, checks both give identical HTML,
+and prints the timings. The linear scan is O(links × pages), so by default
+it is timed on the first --sample pages and extrapolated.
+
+    python3 bench_wikilinks.py                 # 5,000 pages
+    python3 bench_wikilinks.py --pages 1000 --sample 1000
+"""
+
+import argparse
+import importlib.util
+import random
+import re
+import time
+from pathlib import Path
+
+WORDS = "data model scaling curation prototype loss token compute signal noise market team".split()
+
+
+def load_build_html():
+    """build-html.py has a hyphen in its name, so import it by path."""
+    spec = importlib.util.spec_from_file_location("build_html", Path(__file__).with_name("build-html.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_wiki(n_pages, links_per_page=24, seed=7):
+    """(all_pages, contents): titled pages, each linking to random titles and words."""
+    rng = random.Random(seed)
+    titles = [" ".join(rng.choice(WORDS).title() for _ in range(rng.randint(2, 5))) + f" {i}"
+              for i in range(n_pages)]
+    all_pages, contents = [], []
+    for i, title in enumerate(titles):
+        slug = f"{i:04d}-{title.lower().replace(' ', '-')}"
+        all_pages.append((slug, title, f"ch{i * 6 // n_pages + 1:02d}/{slug}.html"))
+        links = " ".join(f"[[{rng.choice(titles)}]]" if rng.random() < .7
+                         else f"[[{rng.choice(WORDS)}|{rng.choice(WORDS)}]]"
+                         for _ in range(links_per_page))
+        contents.append(f"# {title}\n\nSome text about {title}: {links}.\n")
+    return all_pages, contents
+
+
+def linear_wikilinks(build_html, content, all_pages, base_path=""):
+    """The original convert_wikilinks: a linear scan over all_pages per link."""
+    def replace_link(match):
+        link_text = match.group(1)
+        if '|' in link_text:
+            target, display = link_text.split('|', 1)
+        else:
+            target = display = link_text
+        slug = build_html.slugify(target)
+        for page_slug, page_title, page_path in all_pages:
+            if slug in page_slug or build_html.slugify(page_title) == slug:
+                return f'<a href="{base_path}{page_path}">{display}</a>'
+        return display
+    return re.sub(r'\[\[([^\]]+)\]\]', replace_link, content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=5000, help="Pages in the synthetic wiki (default 5000)")
+    parser.add_argument("--sample", type=int, default=200,
+                        help="Pages to run the linear scan on before extrapolating (default 200)")
+    args = parser.parse_args()
+
+    build_html = load_build_html()
+    all_pages, contents = synthetic_wiki(args.pages)
+    sample = contents[:args.sample]
+    links = sum(c.count("[[") for c in contents)
+
+    start = time.perf_counter()
+    linear = [linear_wikilinks(build_html, c, all_pages, "../") for c in sample]
+    t_linear = time.perf_counter() - start
+
+    start = time.perf_counter()
+    resolver = build_html.LinkResolver(all_pages)
+    t_index = time.perf_counter() - start
+    start = time.perf_counter()
+    indexed = [build_html.convert_wikilinks(c, resolver, "../") for c in contents]
+    t_indexed = time.perf_counter() - start
+
+    assert indexed[:len(sample)] == linear, "LinkResolver output differs from the linear scan"
+    print(f"{len(all_pages)} pages, {links} links")
+    print(f"  linear scan:  {t_linear:.2f}s for {len(sample)} pages "
+          f"(~{t_linear * len(contents) / max(1, len(sample)):.0f}s for all)")
+    print(f"  LinkResolver: {t_index * 1000:.0f} ms index + {t_indexed * 1000:.0f} ms for all pages")
+    print(f"  output identical on the {len(sample)} sampled pages")
+
+
+if __name__ == "__main__":
+    main()
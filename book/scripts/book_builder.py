@@ -15,13 +15,25 @@ Usage:
 import os
 import sys
 import json
+import random
 import yaml
+import hashlib
+import threading
+import http.client
 import argparse
+import signal
 import subprocess
+import re
 import tempfile
 import textwrap
+import time
+from contextlib import contextmanager
+from concurrent.futures import CancelledError, FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterator, Optional
+from urllib.parse import urlsplit
+
+from markdown_blocks import tokenize
 
 # ─────────────────────────────────────────────
 # CONSTANTS
@@ -30,6 +42,11 @@ from typing import Optional
 IMAGES_DIR   = Path("images")
 OUTPUT_DIR   = Path("output")
 SOURCES_DIR  = Path("sources")
+CACHE_DIR    = Path(os.environ.get("BOOK_CACHE_DIR", Path.home() / ".cache" / "openclaw-book"))
+
+LLM_CACHE_MAX_BYTES = 512 * 1024 * 1024   # LRU-evicted beyond this
+LLM_CACHE_LOW_WATER = 0.9                 # ...down to this fraction, so eviction runs rarely
+FORMAT_CHUNK_TOKENS = 3000                # manuscript tokens per format call; output must fit max_tokens
 
 SUPPORTED_ENGINES = {"typst", "quarto", "weasyprint"}
 
@@ -76,10 +93,232 @@ def decide_engine(meta: dict) -> str:
         return "typst"  # default — fastest, best typography
 
 
+# ─────────────────────────────────────────────
+# CONCURRENCY LIMITS (process-wide, shared by every book in --batch)
+# ─────────────────────────────────────────────
+
+CONCURRENCY_LIMITS: dict[str, threading.BoundedSemaphore] = {}
+
+
+def set_concurrency_limits(**limits: Optional[int]):
+    """Cap concurrent work per kind ("mflux", "compile"); 0/None lifts the cap. LLM requests are capped by LLM_DISPATCHER."""
+    for kind, n in limits.items():
+        if n:
+            CONCURRENCY_LIMITS[kind] = threading.BoundedSemaphore(n)
+        else:
+            CONCURRENCY_LIMITS.pop(kind, None)
+
+
+@contextmanager
+def concurrency_slot(kind: str):
+    """Hold one `kind` slot for the block; a no-op when that kind is uncapped."""
+    sem = CONCURRENCY_LIMITS.get(kind)
+    if sem is None:
+        yield
+        return
+    with sem:
+        yield
+
+
+# ─────────────────────────────────────────────
+# PROFILING
+# ─────────────────────────────────────────────
+
+class Profiler:
+    """
+    Span recorder for the build. Each span keeps wall time, bytes in/out and,
+    for subprocesses started via run_command, the child's CPU time and peak
+    RSS. Spans may overlap across threads; export as a JSON profile, a table,
+    or a Chrome trace (chrome://tracing, ui.perfetto.dev).
+    """
+
+    def __init__(self):
+        self.t0     = time.monotonic()
+        self.spans  = []
+        self._lock  = threading.Lock()
+        self._tids  = {}
+
+    def begin(self, name: str, cat: str = "stage", **attrs) -> dict:
+        tid = threading.get_ident()
+        with self._lock:
+            self._tids.setdefault(tid, len(self._tids) + 1)
+        return {"name": name, "cat": cat, "tid": self._tids[tid],
+                "start": time.monotonic() - self.t0, "end": None,
+                "bytes_in": 0, "bytes_out": 0, "cpu_s": 0.0, "peak_rss": 0, **attrs}
+
+    def end(self, span: dict):
+        span["end"] = time.monotonic() - self.t0
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, cat: str = "stage", **attrs):
+        record = self.begin(name, cat, **attrs)
+        try:
+            yield record
+        finally:
+            self.end(record)
+
+    def stage(self, name: str):
+        return self.span(name, "stage")
+
+    def summary(self) -> list[dict]:
+        """Non-stage spans aggregated by (category, name)."""
+        rows = {}
+        for sp in self.spans:
+            if sp["cat"] == "stage":
+                continue
+            row = rows.setdefault((sp["cat"], sp["name"]), {
+                "cat": sp["cat"], "name": sp["name"], "calls": 0, "wall_s": 0.0,
+                "bytes_in": 0, "bytes_out": 0, "cpu_s": 0.0, "peak_rss": 0})
+            row["calls"]     += 1
+            row["wall_s"]    += sp["end"] - sp["start"]
+            row["bytes_in"]  += sp["bytes_in"]
+            row["bytes_out"] += sp["bytes_out"]
+            row["cpu_s"]     += sp["cpu_s"]
+            row["peak_rss"]   = max(row["peak_rss"], sp["peak_rss"])
+        return sorted(rows.values(), key=lambda r: -r["wall_s"])
+
+    def report(self) -> str:
+        def mb(n):
+            if not n:
+                return "-"
+            return f"{n / 1024:.1f}K" if n < 1024**2 else f"{n / 1024**2:.1f}M"
+        lines = ["   Stage timings:"]
+        for sp in sorted((sp for sp in self.spans if sp["cat"] == "stage"), key=lambda sp: sp["start"]):
+            lines.append(f"     {sp['name']:<14} {sp['start']:7.1f}s → {sp['end']:7.1f}s  ({sp['end'] - sp['start']:.1f}s)")
+        lines.append(f"     {'total':<14} {time.monotonic() - self.t0:25.1f}s")
+        rows = self.summary()
+        if rows:
+            lines.append("   Profile:")
+            lines.append(f"     {'category':<9} {'name':<22} {'calls':>5} {'wall':>8} {'in':>8} {'out':>8} {'cpu':>7} {'peak rss':>9}")
+            for r in rows:
+                lines.append(f"     {r['cat']:<9} {r['name'][:22]:<22} {r['calls']:>5} {r['wall_s']:7.1f}s "
+                             f"{mb(r['bytes_in']):>8} {mb(r['bytes_out']):>8} {r['cpu_s']:6.1f}s {mb(r['peak_rss']):>9}")
+        return "\n".join(lines)
+
+    def write_json(self, path: Path):
+        path.write_text(json.dumps({"spans": self.spans, "summary": self.summary()}, indent=1))
+
+    def write_chrome_trace(self, path: Path):
+        events = [{
+            "name": sp["name"], "cat": sp["cat"], "ph": "X", "pid": 1, "tid": sp["tid"],
+            "ts": round(sp["start"] * 1e6), "dur": round((sp["end"] - sp["start"]) * 1e6),
+            "args": {k: v for k, v in sp.items() if k not in {"name", "cat", "tid", "start", "end"}},
+        } for sp in self.spans]
+        path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+
+PROFILER = Profiler()
+
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024   # ru_maxrss: bytes on macOS, KiB on Linux
+
+
+def run_command(
+    cmd: list[str],
+    span: Optional[dict] = None,
+    capture: bool = False,
+    cwd: Optional[Path] = None,
+    on_spawn: Optional[Callable[[subprocess.Popen], None]] = None,
+) -> tuple[int, Optional[str], Optional[str]]:
+    """
+    Run a subprocess and return (returncode, stdout, stderr). The child is
+    reaped with os.wait4 so its own CPU time and peak RSS are added to `span`
+    (exact even when other stages run children concurrently).
+    """
+    pipe = subprocess.PIPE if capture else None
+    proc = subprocess.Popen(cmd, stdout=pipe, stderr=pipe, text=True, cwd=cwd)
+    if on_spawn:
+        on_spawn(proc)
+    output = {}
+    readers = [
+        threading.Thread(target=lambda name, f: output.__setitem__(name, f.read()), args=(name, f), daemon=True)
+        for name, f in (("stdout", proc.stdout), ("stderr", proc.stderr)) if f
+    ]
+    for t in readers:
+        t.start()
+    try:
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if span is not None:
+            span["cpu_s"]   += usage.ru_utime + usage.ru_stime
+            span["peak_rss"] = max(span["peak_rss"], usage.ru_maxrss * _RSS_UNIT)
+    except (AttributeError, ChildProcessError):
+        proc.wait()  # no wait4 here, or a concurrent terminate()/poll() already reaped it
+    for t in readers:
+        t.join()
+    return proc.returncode, output.get("stdout"), output.get("stderr")
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
 # ─────────────────────────────────────────────
 # IMAGE GENERATION (mflux / Flux.1 via MLX)
 # ─────────────────────────────────────────────
 
+MFLUX_MEM_GB = {"schnell": 9, "dev": 12}   # rough peak memory of one q4 mflux-generate process
+IMAGE_MANIFEST = ".manifest.json"           # sidecar in each images dir: {filename: params hash}
+IMAGE_STORE    = CACHE_DIR / "images"       # shared across books: {params hash}.png
+
+_manifest_lock = threading.Lock()
+_store_locks: dict[str, threading.Lock] = {}
+
+
+def image_params_hash(prompt: str, model: str, quant: int, steps: Optional[int],
+                      width: int, height: int, seed: Optional[int]) -> str:
+    payload = json.dumps([prompt, model, quant, steps, width, height, seed], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_manifest(images_dir: Path = IMAGES_DIR) -> dict:
+    try:
+        return json.loads((images_dir / IMAGE_MANIFEST).read_text())
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _update_manifest(filename: str, digest: Optional[str], images_dir: Path = IMAGES_DIR):
+    """Set (or with digest=None, drop) one manifest entry. Safe across threads."""
+    with _manifest_lock:
+        manifest = _load_manifest(images_dir)
+        if digest is None:
+            manifest.pop(filename, None)
+        else:
+            manifest[filename] = digest
+        tmp = images_dir / f"{IMAGE_MANIFEST}.tmp"
+        tmp.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+        os.replace(tmp, images_dir / IMAGE_MANIFEST)
+
+
+def image_is_current(filename: str, digest: str, images_dir: Path = IMAGES_DIR) -> bool:
+    """True when images/{filename}.png exists and was generated from identical parameters."""
+    return (images_dir / f"{filename}.png").exists() and _load_manifest(images_dir).get(filename) == digest
+
+
+def _store_lock(digest: str) -> threading.Lock:
+    with _manifest_lock:
+        return _store_locks.setdefault(digest, threading.Lock())
+
+
+def _link_file(src: Path, dest: Path):
+    """Make dest the same file as src without copying bytes: hardlink, else symlink, else copy."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    dest.unlink(missing_ok=True)
+    try:
+        os.link(src, dest)
+    except OSError:  # cross-device or unsupported filesystem
+        try:
+            dest.symlink_to(src.resolve())
+        except OSError:
+            import shutil
+            shutil.copy2(src, dest)
+
+
 def generate_image(
     prompt: str,
     filename: str,
@@ -89,74 +328,1103 @@ def generate_image(
     width: int = 1024,
     height: int = 1024,
     seed: Optional[int] = None,
+    on_spawn: Optional[Callable[[subprocess.Popen], None]] = None,
+    verbose: bool = True,
+    force: bool = False,
+    images_dir: Path = IMAGES_DIR,
 ) -> Path:
-    """Generate one image with mflux (local Flux.1, arm64-native). Returns PNG path."""
-    IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-    out = IMAGES_DIR / f"{filename}.png"
-
-    cmd = [
-        "mflux-generate",
-        "--model", model,
-        "-q", str(quant),
-        "--prompt", prompt,
-        "--width", str(width),
-        "--height", str(height),
-        "--output", str(out),
-    ]
-    if steps:
-        cmd.extend(["--steps", str(steps)])
-    if seed is not None:
-        cmd.extend(["--seed", str(seed)])
-
-    print(f"  🖼  Generating: {filename} ({model}, q{quant}) ...")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"mflux-generate failed:\n{result.stderr}")
-    if not out.exists():
-        raise FileNotFoundError(f"Image not created: {out}")
-    print(f"      ✓ {out}")
+    """
+    Generate one image with mflux (local Flux.1, arm64-native). Returns PNG path.
+    Reuses the existing PNG when the manifest shows identical parameters, or
+    links one from the shared IMAGE_STORE that another book generated from
+    identical parameters, unless force.
+    on_spawn receives the running process so a scheduler can terminate it.
+    """
+    images_dir.mkdir(parents=True, exist_ok=True)
+    out = images_dir / f"{filename}.png"
+    digest = image_params_hash(prompt, model, quant, steps, width, height, seed)
+    if not force and image_is_current(filename, digest, images_dir):
+        if verbose:
+            print(f"  🖼  Unchanged: {filename} (reusing {out})")
+        return out
+    stored = IMAGE_STORE / f"{digest}.png"
+    with _store_lock(digest):  # books wanting the same image share one mflux run
+        if not force and stored.exists():
+            _link_file(stored, out)
+            _update_manifest(filename, digest, images_dir)
+            if verbose:
+                print(f"  🖼  Shared: {filename} (from {stored})")
+            return out
+        _update_manifest(filename, None, images_dir)  # a failed run must not leave a stale match
+        out.unlink(missing_ok=True)  # may be a link into IMAGE_STORE; mflux must not write through it
+
+        cmd = [
+            "mflux-generate",
+            "--model", model,
+            "-q", str(quant),
+            "--prompt", prompt,
+            "--width", str(width),
+            "--height", str(height),
+            "--output", str(out),
+        ]
+        if steps:
+            cmd.extend(["--steps", str(steps)])
+        if seed is not None:
+            cmd.extend(["--seed", str(seed)])
+
+        if verbose:
+            print(f"  🖼  Generating: {filename} ({model}, q{quant}) ...")
+        with concurrency_slot("mflux"), \
+             PROFILER.span("mflux-generate", "image", bytes_in=len(prompt.encode("utf-8")), model=model) as span:
+            returncode, _, stderr = run_command(cmd, span, capture=True, on_spawn=on_spawn)
+            span["bytes_out"] = _file_size(out)
+        if returncode != 0:
+            raise RuntimeError(f"mflux-generate failed for {filename} (exit {returncode}):\n{stderr}")
+        if not out.exists():
+            raise FileNotFoundError(f"Image not created: {out}")
+        _update_manifest(filename, digest, images_dir)
+        try:
+            _link_file(out, stored)
+        except OSError:
+            pass  # the store is an optimisation; the book's own copy is what counts
+    if verbose:
+        print(f"      ✓ {out}")
     return out
 
 
-def batch_generate_images(image_list: list[dict], book_type: str = "text_heavy") -> list[Path]:
+def default_image_workers(model: str = "schnell") -> int:
+    """Concurrent mflux processes that fit this machine: bounded by CPU count and memory."""
+    cpus = os.cpu_count() or 1
+    try:
+        page = os.sysconf("SC_PAGE_SIZE")
+        try:
+            mem = os.sysconf("SC_AVPHYS_PAGES") * page
+        except (ValueError, OSError):
+            mem = os.sysconf("SC_PHYS_PAGES") * page // 2  # macOS: no "available" figure
+    except (ValueError, OSError, AttributeError):
+        mem = 0
+    by_mem = int(mem // (MFLUX_MEM_GB.get(model, 12) * 1024**3)) if mem else 1
+    by_cpu = max(1, cpus // 4)
+    return max(1, min(by_cpu, by_mem))
+
+
+class ImageQueue:
     """
-    Generate all images for a book.
-    image_list: [{"filename": "cover", "prompt": "..."}, ...]
+    Runs up to `workers` mflux-generate processes at once.
+    Fails fast: the first failed image terminates every running process and
+    cancels everything still queued; join() then re-raises that failure.
+    """
+
+    def __init__(self, workers: int, on_image: Optional[Callable[[Path], None]] = None):
+        self.workers  = max(1, workers)
+        self.on_image = on_image
+        self._pool    = ThreadPoolExecutor(max_workers=self.workers)
+        self._futures = []
+        self.filenames = set()   # everything submitted so far
+        self._procs   = set()
+        self._lock    = threading.Lock()
+        self._failed  = threading.Event()
+        self._error   = None
+        self._total   = 0
+        self._done    = 0
+
+    def submit(self, **image_kwargs) -> Future:
+        """Queue one generate_image(**image_kwargs) call."""
+        with self._lock:
+            self._total += 1
+            self.filenames.add(image_kwargs["filename"])
+            fut = self._pool.submit(self._run, image_kwargs)
+            self._futures.append(fut)
+        return fut
+
+    def add_existing(self, path: Path) -> Future:
+        """Record an already-available image so join() returns it in order."""
+        fut = Future()
+        fut.set_result(path)
+        with self._lock:
+            self.filenames.add(path.stem)
+            self._futures.append(fut)
+        if self.on_image:
+            self.on_image(path)
+        return fut
+
+    def _track(self, proc: subprocess.Popen):
+        with self._lock:
+            if self._failed.is_set():
+                proc.terminate()
+            self._procs.add(proc)
+
+    def _run(self, image_kwargs: dict) -> Path:
+        if self._failed.is_set():
+            raise CancelledError()
+        name = image_kwargs["filename"]
+        t0 = time.monotonic()
+        try:
+            path = generate_image(**image_kwargs, on_spawn=self._track, verbose=False)
+        except Exception as e:
+            with self._lock:
+                first = self._error is None and not self._failed.is_set()
+                if first:
+                    self._error = e
+            if first:
+                print(f"      ✗ {name} failed — stopping remaining images")
+            self.abort()
+            raise
+        with self._lock:
+            self._done += 1
+            print(f"      ✓ [{self._done}/{self._total}] {name} ({time.monotonic() - t0:.1f}s)")
+        if self.on_image:
+            self.on_image(path)
+        return path
+
+    def abort(self):
+        """Terminate running processes and cancel queued images."""
+        self._failed.set()
+        with self._lock:
+            procs = list(self._procs)
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+        for fut in self._futures:
+            fut.cancel()
+
+    def join(self) -> list[Path]:
+        """Wait for every queued image; returns paths in submission order."""
+        try:
+            with self._lock:
+                futures = list(self._futures)
+            wait(futures, return_when=FIRST_EXCEPTION)
+            if self._error is not None:
+                raise self._error
+            return [fut.result() for fut in futures]
+        finally:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+def queue_images(
+    image_list: list[dict],
+    book_type: str = "text_heavy",
+    workers: Optional[int] = None,
+    force: bool = False,
+    on_image: Optional[Callable[[Path], None]] = None,
+    queue: Optional[ImageQueue] = None,
+    images_dir: Path = IMAGES_DIR,
+) -> ImageQueue:
     """
+    Start generating all images for a book and return immediately; join() the
+    queue for the paths. Images whose parameters match the manifest are reused
+    without running mflux. on_image is called with each path as it becomes ready.
+    Pass an existing `queue` to add to it; filenames it already has are skipped.
+    """
+    if queue is not None:
+        image_list = [item for item in image_list if item["filename"] not in queue.filenames]
     # Pick model based on book type: schnell (fast) for kids, dev (quality) for coffee_table/scientific
     model = "dev" if book_type in {"coffee_table", "scientific", "academic"} else "schnell"
     steps = 30 if model == "dev" else None
+    params = dict(model=model, quant=4, steps=steps, width=1024, height=1024, seed=None)
+
+    current = {
+        item["filename"]
+        for item in image_list
+        if not force and image_is_current(item["filename"], image_params_hash(item["prompt"], **params), images_dir)
+    }
+    todo = len(image_list) - len(current)
+    if queue is None:
+        queue = ImageQueue(workers or default_image_workers(model), on_image=on_image)
+    if current:
+        print(f"  🖼  {len(current)} image(s) unchanged, reusing")
+    if todo:
+        print(f"  🖼  Generating {todo} image(s) with {model}, {queue.workers} at a time...")
 
-    paths = []
     for item in image_list:
-        path = generate_image(
-            prompt=item["prompt"],
-            filename=item["filename"],
+        if item["filename"] in current:
+            queue.add_existing(images_dir / f"{item['filename']}.png")
+        else:
+            queue.submit(
+                prompt=item["prompt"],
+                filename=item["filename"],
+                **params,
+                force=force,
+                images_dir=images_dir,
+            )
+    return queue
+
+
+def batch_generate_images(
+    image_list: list[dict],
+    book_type: str = "text_heavy",
+    workers: Optional[int] = None,
+    force: bool = False,
+    images_dir: Path = IMAGES_DIR,
+) -> list[Path]:
+    """
+    Generate all images for a book, up to `workers` at a time
+    (default: sized from CPU count and available memory).
+    image_list: [{"filename": "cover", "prompt": "..."}, ...]
+    """
+    return queue_images(image_list, book_type, workers, force, images_dir=images_dir).join()
+
+
+# ─────────────────────────────────────────────
+# IMAGE RENDITIONS (print / EPUB, via Pillow)
+# ─────────────────────────────────────────────
+
+RENDITION_DIR  = CACHE_DIR / "renditions"   # {hash of source bytes + settings}{ext}, shared across books
+PRINT_DPI      = 300
+EPUB_IMAGE_PX  = 1200
+TRIM_SIZES_IN  = {"6x9": (6, 9), "8.5x11": (8.5, 11), "letter": (8.5, 11), "square": (8.5, 8.5)}
+EPUB_IMAGE_FORMATS = {"jpeg": ("JPEG", ".jpg"), "webp": ("WEBP", ".webp")}
+IMAGE_REF_RE   = re.compile(r"images/([\w.-]+?)\.png")
+IMAGE_MARKER_RE = re.compile(r"\[IMAGE:[ \t]*(.+?)[ \t]*→[ \t]*(\S+)\]")   # one line; never spans a newline
+
+
+def print_image_px(trim_size: str) -> int:
+    """Pixels across the trim width at PRINT_DPI: the most a full-width image can show."""
+    width = TRIM_SIZES_IN.get(trim_size, (None,))[0]
+    if width is None:
+        try:
+            width = float(str(trim_size).lower().split("x")[0])
+        except ValueError:
+            width = 8.5
+    return int(width * PRINT_DPI)
+
+
+def _render_image(src: Path, dest: Path, max_px: int, fmt: str, quality: int) -> int:
+    """Process-pool worker: fit src within max_px (never upscaling) and encode as fmt. Returns bytes written."""
+    from PIL import Image
+    with Image.open(src) as im:
+        im = im.convert("RGB")  # JPEG has no alpha channel, and Flux output has none to lose
+        im.thumbnail((max_px, max_px), Image.Resampling.LANCZOS)
+        options = {"quality": quality}
+        if fmt == "JPEG":
+            options.update(optimize=True, progressive=True, subsampling=0 if quality >= 90 else 2)
+        elif fmt == "WEBP":
+            options.update(method=6)
+        tmp = dest.with_name(f"{dest.name}.{os.getpid()}.tmp")
+        im.save(tmp, fmt, **options)
+    os.replace(tmp, dest)
+    return dest.stat().st_size
+
+
+def make_renditions(
+    paths: list[Path],
+    images_dir: Path = IMAGES_DIR,
+    trim_size: str = "6x9",
+    epub_format: str = "jpeg",
+    workers: Optional[int] = None,
+    quiet: bool = False,
+) -> dict[str, dict[str, Path]]:
+    """
+    Per-target copies of generated PNGs, so compilers and the EPUB stop
+    embedding 1024px lossless images:
+      print  JPEG q92 (4:4:4), fit to the trim width at PRINT_DPI
+      epub   JPEG or WebP q80, fit to EPUB_IMAGE_PX
+    Encoding runs in a process pool; results are cached in RENDITION_DIR by
+    source hash + settings and linked into images_dir/print/ and images_dir/epub/.
+    Returns {target: {image stem: path}}, or {} when Pillow is not installed.
+    quiet: no summary line (for pre-encoding single images while others generate).
+    """
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        if not quiet:
+            print("  ⚠️  Pillow not installed — embedding full-size PNGs (pip install pillow)")
+        return {}
+    targets = {
+        "print": ("JPEG", ".jpg", print_image_px(trim_size), 92),
+        "epub":  (*EPUB_IMAGE_FORMATS[epub_format], EPUB_IMAGE_PX, 80),
+    }
+    renditions = {target: {} for target in targets}
+    jobs, links = {}, []
+    for src in paths:
+        digest = hashlib.sha256(src.read_bytes()).hexdigest()
+        for target, (fmt, ext, max_px, quality) in targets.items():
+            cached = RENDITION_DIR / f"{_sha(f'{digest}:{fmt}:{max_px}:{quality}')}{ext}"
+            dest = images_dir / target / f"{src.stem}{ext}"
+            if not cached.exists():
+                jobs[cached] = (src, cached, max_px, fmt, quality)
+            links.append((cached, dest))
+            renditions[target][src.stem] = dest
+
+    if jobs:
+        RENDITION_DIR.mkdir(parents=True, exist_ok=True)
+        from concurrent.futures import ProcessPoolExecutor
+        bytes_in = sum(_file_size(job[0]) for job in jobs.values())
+        with PROFILER.span("pillow", "image", bytes_in=bytes_in, images=len(jobs)) as span, \
+             ProcessPoolExecutor(max_workers=min(len(jobs), workers or os.cpu_count() or 1)) as pool:
+            span["bytes_out"] = sum(pool.map(_render_image, *zip(*jobs.values())))
+    for cached, dest in links:
+        if not (dest.exists() and os.path.samefile(cached, dest)):
+            _link_file(cached, dest)
+
+    if quiet:
+        return renditions
+    src_bytes = sum(_file_size(p) for p in paths)
+    sizes = ", ".join(f"{target} {sum(_file_size(p) for p in r.values()) / 1e6:.1f} MB"
+                      for target, r in renditions.items())
+    print(f"  🖼  Renditions: {len(paths)} image(s), {len(jobs)} encoded, "
+          f"{src_bytes / 1e6:.1f} MB PNG → {sizes}")
+    return renditions
+
+
+def rewrite_image_refs(text: str, renditions: dict[str, Path], images_dir: Path = IMAGES_DIR) -> str:
+    """Point images/NAME.png references at their renditions (e.g. images/print/NAME.jpg)."""
+    def sub(m: "re.Match") -> str:
+        path = renditions.get(m.group(1))
+        return f"images/{path.relative_to(images_dir).as_posix()}" if path else m.group(0)
+    return IMAGE_REF_RE.sub(sub, text)
+
+
+def embed_image_markers(manuscript: str, images: dict[str, Path], images_dir: Path = IMAGES_DIR) -> str:
+    """
+    Replace [IMAGE: prompt → filename] markers outside fenced code with
+    Markdown images. A marker with no entry in images keeps its original
+    images_dir/filename.png path (with a warning) rather than vanishing.
+    """
+    missing = []
+
+    def sub(m: "re.Match") -> str:
+        path = images.get(m.group(2))
+        if path is None:
+            missing.append(m.group(2))
+            path = images_dir / f"{m.group(2)}.png"
+        return f"![]({path.resolve().as_posix()})"
+    embedded = "\n".join(line.raw if line.kind in ("fence", "code") else IMAGE_MARKER_RE.sub(sub, line.raw)
+                         for line in tokenize(manuscript))
+    if missing:
+        print(f"  ⚠️  No rendition for {len(missing)} image marker(s), using the original path: "
+              f"{', '.join(sorted(set(missing)))}")
+    return embedded
+
+
+def marker_renditions(manuscript: str, image_list: list[dict], renditions: dict[str, Path]) -> dict[str, Path]:
+    """
+    {marker filename: rendition} for the manuscript's [IMAGE: ...] markers.
+    LLM formatting may rename images, so a marker whose filename has no
+    rendition is matched to the generated image with the same prompt.
+    """
+    by_prompt = {img["prompt"].strip(): renditions[img["filename"]]
+                 for img in image_list if img.get("filename") in renditions and img.get("prompt")}
+    images = {}
+    for marker in manuscript_images(manuscript):
+        path = renditions.get(marker["filename"]) or by_prompt.get(marker["prompt"].strip())
+        if path is not None:
+            images[marker["filename"]] = path
+    return images
+
+
+# ─────────────────────────────────────────────
+# LLM RESPONSE CACHE (content-addressed, LRU)
+# ─────────────────────────────────────────────
+
+class LLMCache:
+    """
+    On-disk cache of LLM responses keyed by sha256(model, prompt, max_tokens).
+    A hit bumps the entry's mtime, so eviction (oldest mtime first) is LRU.
+    The cache size is scanned once and then tracked per put; the directory is
+    only walked again when that total goes over max_bytes, and eviction then
+    frees down to LLM_CACHE_LOW_WATER of it so the next walk is many puts away.
+    mode: "use" (read + write) | "refresh" (write only) | "off"
+    """
+
+    def __init__(self, root: Path, max_bytes: int = LLM_CACHE_MAX_BYTES, mode: str = "use"):
+        self.root      = root
+        self.max_bytes = max_bytes
+        self.mode      = mode
+        self.hits      = 0
+        self.misses    = 0
+        self._lock     = threading.Lock()
+        self._size     = None   # bytes on disk; None until the first put scans the cache
+
+    @staticmethod
+    def key(model: str, prompt: str, max_tokens: int) -> str:
+        payload = json.dumps([model, prompt, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.txt"
+
+    def get(self, key: str) -> Optional[str]:
+        if self.mode == "off":
+            return None
+        path = self._path(key)
+        if self.mode == "use" and path.exists():
+            try:
+                text = path.read_text(encoding="utf-8")
+                os.utime(path)  # mark as recently used
+            except OSError:
+                text = None
+            if text is not None:
+                with self._lock:
+                    self.hits += 1
+                return text
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, text: str):
+        if self.mode == "off":
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        replaced = _file_size(path)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(text, encoding="utf-8")
+        size = _file_size(tmp)
+        os.replace(tmp, path)  # atomic: readers never see a partial entry
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += size - replaced
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        for f in self.root.glob("*/*.txt"):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+        return entries
+
+    def evict(self):
+        """Delete least-recently-used entries once the cache exceeds max_bytes, down to the low-water mark."""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * LLM_CACHE_LOW_WATER if total > self.max_bytes else total
+            for _, size, f in sorted(entries):
+                if total <= target:
+                    break
+                f.unlink(missing_ok=True)
+                total -= size
+            self._size = total
+
+    def summary(self) -> str:
+        if self.mode == "off":
+            return "LLM cache: disabled"
+        return f"LLM cache: {self.hits} hit(s), {self.misses} miss(es)"
+
+
+LLM_CACHE = LLMCache(CACHE_DIR / "llm")
+
+
+# ─────────────────────────────────────────────
+# LLM BACKENDS
+# ─────────────────────────────────────────────
+
+class LLMHTTPError(RuntimeError):
+    """Non-2xx response from an LLM HTTP API (status_code mirrors anthropic.APIStatusError)."""
+
+    def __init__(self, status_code: int, body: str, headers=None):
+        super().__init__(f"HTTP {status_code}: {body[:500]}")
+        self.status_code = status_code
+        self.body        = body
+        self.headers     = headers or {}
+
+
+class LLMBackend:
+    """
+    Pluggable completion backend. Instances are long-lived and shared across threads.
+    When the API reports token usage, complete/stream store it in the `usage`
+    dict passed in (input_tokens, output_tokens).
+    """
+
+    name = "base"
+
+    def resolve_model(self, model: str) -> str:
+        return model
+
+    def complete(self, prompt: str, model: str, max_tokens: int, usage: Optional[dict] = None) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, model: str, max_tokens: int, usage: Optional[dict] = None) -> Iterator[str]:
+        yield self.complete(prompt, model, max_tokens, usage)
+
+
+class AnthropicBackend(LLMBackend):
+    """Anthropic Messages API through one client (and HTTP connection pool) for the whole run."""
+
+    name = "anthropic"
+
+    def __init__(self):
+        self._client = None
+        self._lock   = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import anthropic
+                # reads ANTHROPIC_API_KEY (and ANTHROPIC_BASE_URL) from env; LLM_DISPATCHER does the retrying
+                self._client = anthropic.Anthropic(max_retries=0)
+            return self._client
+
+    @staticmethod
+    def _usage(message, usage: Optional[dict]):
+        if usage is not None and getattr(message, "usage", None) is not None:
+            usage["input_tokens"]  = message.usage.input_tokens
+            usage["output_tokens"] = message.usage.output_tokens
+
+    def complete(self, prompt: str, model: str, max_tokens: int, usage: Optional[dict] = None) -> str:
+        message = self.client.messages.create(
             model=model,
-            steps=steps,
+            max_tokens=max_tokens,
+            messages=[{"role": "user", "content": prompt}],
         )
-        paths.append(path)
-    return paths
+        self._usage(message, usage)
+        return message.content[0].text
+
+    def stream(self, prompt: str, model: str, max_tokens: int, usage: Optional[dict] = None) -> Iterator[str]:
+        with self.client.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            messages=[{"role": "user", "content": prompt}],
+        ) as stream:
+            yield from stream.text_stream
+            self._usage(stream.get_final_message(), usage)
+
+
+class OllamaBackend(LLMBackend):
+    """
+    Local Ollama server (/api/generate). Each thread keeps one persistent
+    keep-alive HTTP connection, and keep_alive holds the model in memory
+    between calls, so concurrent chunk/chapter requests are served back to
+    back without reconnecting or reloading (set OLLAMA_NUM_PARALLEL on the
+    server to batch them). Claude model names from call sites are replaced
+    with `model`.
+    """
+
+    name = "ollama"
+
+    def __init__(self, model: str = "qwen2.5:7b", host: Optional[str] = None,
+                 keep_alive: str = "30m", timeout: float = 600):
+        raw = host or os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
+        url = urlsplit(raw if "://" in raw else f"http://{raw}")  # OLLAMA_HOST is often bare host:port
+        self.model      = model
+        self.host       = url.hostname or "127.0.0.1"
+        self.port       = url.port or 11434
+        self.keep_alive = keep_alive
+        self.timeout    = timeout
+        self._local     = threading.local()
+
+    def resolve_model(self, model: str) -> str:
+        return self.model
+
+    def _connection(self, fresh: bool = False) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or fresh:
+            if conn is not None:
+                conn.close()
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _post(self, payload: dict) -> http.client.HTTPResponse:
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        for attempt in (0, 1):
+            conn = self._connection(fresh=attempt > 0)
+            try:
+                conn.request("POST", "/api/generate", body=body, headers=headers)
+                resp = conn.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if attempt:  # server really is gone, not just an idle connection it dropped
+                    raise
+        if resp.status >= 300:
+            raise LLMHTTPError(resp.status, resp.read().decode("utf-8", "replace"), resp.headers)
+        return resp
+
+    def _payload(self, prompt: str, model: str, max_tokens: int, stream: bool) -> dict:
+        return {
+            "model":      model,
+            "prompt":     prompt,
+            "stream":     stream,
+            "keep_alive": self.keep_alive,
+            "options":    {"num_predict": max_tokens},
+        }
+
+    @staticmethod
+    def _usage(event: dict, usage: Optional[dict]):
+        if usage is not None and "eval_count" in event:
+            usage["input_tokens"]  = event.get("prompt_eval_count", 0)
+            usage["output_tokens"] = event["eval_count"]
+
+    def complete(self, prompt: str, model: str, max_tokens: int, usage: Optional[dict] = None) -> str:
+        resp = self._post(self._payload(prompt, model, max_tokens, stream=False))
+        event = json.loads(resp.read())
+        self._usage(event, usage)
+        return event["response"]
+
+    def stream(self, prompt: str, model: str, max_tokens: int, usage: Optional[dict] = None) -> Iterator[str]:
+        resp = self._post(self._payload(prompt, model, max_tokens, stream=True))
+        try:
+            for line in resp:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event.get("response"):
+                    yield event["response"]
+                if event.get("done"):
+                    self._usage(event, usage)
+                    break
+        finally:
+            resp.read()  # drain so the connection can be reused
+
+
+LLM_BACKENDS = {"anthropic": AnthropicBackend, "ollama": OllamaBackend}
+LLM_BACKEND: LLMBackend = AnthropicBackend()
+
+
+def set_llm_backend(backend: LLMBackend):
+    """Route every call_llm / call_llm_stream through `backend`."""
+    global LLM_BACKEND
+    LLM_BACKEND = backend
+
+
+# ─────────────────────────────────────────────
+# LLM DISPATCH (rate limits, retries, adaptive concurrency)
+# ─────────────────────────────────────────────
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}   # 529: Anthropic "overloaded"
+THROTTLE_STATUS  = {429, 529}
+
+
+class TokenBucket:
+    """
+    Refills at `per_minute` tokens a minute, holding at most one minute's worth.
+    acquire(n) blocks until n tokens are available (n is capped at capacity so
+    one oversized request cannot wait forever); debit(n) charges usage known
+    only afterwards and may push the balance negative, delaying later acquires.
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate     = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens   = self.capacity
+        self._last    = time.monotonic()
+        self._lock    = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last  = now
+
+    def acquire(self, n: float = 1) -> float:
+        """Take n tokens, sleeping as needed; returns the seconds waited."""
+        n = min(n, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return waited
+                delay = (n - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def debit(self, n: float):
+        with self._lock:
+            self._refill()
+            self.tokens -= n
+
+
+class AdaptiveLimit:
+    """
+    AIMD concurrency limit: halved when a request is throttled (at most once
+    per round of in-flight requests, never below 1) and raised by one after
+    `limit` successes in a row, back up to `maximum`.
+    """
+
+    def __init__(self, maximum: int):
+        self.maximum   = max(1, maximum)
+        self.limit     = self.maximum
+        self.lowest    = self.maximum
+        self.in_flight = 0
+        self._ok       = 0
+        self._cut_at   = 0.0
+        self._cond     = threading.Condition()
+
+    def acquire(self) -> float:
+        """Wait for a slot; returns the start time to hand back to release()."""
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started: float, throttled: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                if started >= self._cut_at:  # requests already in flight at the last cut don't cut again
+                    self.limit   = max(1, self.limit // 2)
+                    self.lowest  = min(self.lowest, self.limit)
+                    self._cut_at = time.monotonic()
+                self._ok = 0
+            else:
+                self._ok += 1
+                if self._ok >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._ok    = 0
+            self._cond.notify_all()
+
+
+def _transient_errors() -> tuple:
+    errors = [ConnectionError, TimeoutError, http.client.HTTPException]
+    try:
+        import anthropic
+        errors.append(anthropic.APIConnectionError)  # includes APITimeoutError
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Seconds from a Retry-After header on an LLMHTTPError or anthropic.APIStatusError."""
+    headers = getattr(exc, "headers", None) or getattr(getattr(exc, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after")) if headers else None
+    except (TypeError, ValueError):
+        return None  # absent, or an HTTP date
+
+
+class LLMDispatcher:
+    """
+    Gate for every LLM request: optional requests- and tokens-per-minute
+    buckets, an AIMD concurrency limit, and retries on 429 / 5xx / 529 and
+    connection errors with full-jitter exponential backoff. A Retry-After
+    from the server pauses every thread, not just the one that got it.
+    Shared by all threads (and every book in --batch).
+    """
+
+    def __init__(self, max_concurrency: int = 8, rpm: Optional[int] = None, tpm: Optional[int] = None,
+                 max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.limit       = AdaptiveLimit(max_concurrency)
+        self.rpm         = TokenBucket(rpm) if rpm else None
+        self.tpm         = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.base_delay  = base_delay
+        self.max_delay   = max_delay
+        self.retries     = 0
+        self.throttled   = 0
+        self.rate_wait   = 0.0
+        self._pause_until = 0.0
+        self._lock       = threading.Lock()
+
+    def _backoff(self, exc: Exception, attempt: int) -> float:
+        delay = _retry_after(exc)
+        if delay is not None:
+            with self._lock:
+                self._pause_until = max(self._pause_until, time.monotonic() + delay)
+            return delay
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _wait_for_pause(self):
+        while (remaining := self._pause_until - time.monotonic()) > 0:
+            time.sleep(remaining)
+
+    def run(self, request: Callable[[], str], prompt_tokens: int = 0) -> str:
+        """Call request() under the limits, retrying transient failures; returns its text."""
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_pause()
+            waited = self.rpm.acquire(1) if self.rpm else 0.0
+            waited += self.tpm.acquire(prompt_tokens) if self.tpm else 0.0
+            started = self.limit.acquire()
+            try:
+                text = request()
+            except Exception as e:
+                status    = getattr(e, "status_code", None)
+                throttled = status in THROTTLE_STATUS
+                self.limit.release(started, throttled)
+                retryable = status in RETRYABLE_STATUS if status is not None else isinstance(e, _transient_errors())
+                if not retryable or attempt == self.max_retries:
+                    raise
+                delay = self._backoff(e, attempt)
+                with self._lock:
+                    self.retries   += 1
+                    self.throttled += throttled
+                    self.rate_wait += waited
+                print(f"  ⏳ LLM {status or type(e).__name__}, retry {attempt + 1}/{self.max_retries} "
+                      f"in {delay:.1f}s (concurrency {self.limit.limit})")
+                time.sleep(delay)
+                continue
+            self.limit.release(started)
+            if self.tpm:
+                self.tpm.debit(estimate_tokens(text))
+            with self._lock:
+                self.rate_wait += waited
+            return text
+
+    def summary(self) -> str:
+        return (f"LLM dispatch: {self.retries} retries ({self.throttled} throttled), "
+                f"concurrency {self.limit.limit}/{self.limit.maximum} (lowest {self.limit.lowest}), "
+                f"{self.rate_wait:.1f}s waiting on rate limits")
+
+
+LLM_DISPATCHER = LLMDispatcher()
+
+
+def set_llm_dispatcher(dispatcher: LLMDispatcher):
+    """Gate every call_llm / call_llm_stream request through `dispatcher`."""
+    global LLM_DISPATCHER
+    LLM_DISPATCHER = dispatcher
+
+
+# ─────────────────────────────────────────────
+# MODEL ROUTING (task → tier → model)
+# ─────────────────────────────────────────────
+
+MODEL_TIERS = {
+    "flagship": "claude-opus-4-5-20251001",
+    "balanced": "claude-sonnet-4-5-20250929",
+    "fast":     "claude-haiku-4-5-20251001",
+}
+LLM_ROUTING = {            # task → tier name or model id; per book: `llm_routing:` in book.yaml
+    "manuscript": "flagship",   # one-shot manuscript prose
+    "chapter":    "flagship",   # sharded chapter prose
+    "outline":    "balanced",   # chapter plan (JSON)
+    "format":     "balanced",   # Markdown → Typst / Quarto / HTML, plus the image list
+    "preamble":   "fast",       # template and config boilerplate for per-chapter formatting
+}
+LLM_PRICING = {            # USD per million (input, output) tokens, matched by model-id prefix
+    "claude-opus-4-5":   (5.00, 25.00),
+    "claude-sonnet-4-5": (3.00, 15.00),
+    "claude-haiku-4-5":  (1.00,  5.00),
+}
+
+
+def route_model(task: str, meta: Optional[dict] = None) -> str:
+    """Model for a pipeline task: book.yaml `llm_routing` over LLM_ROUTING; values are tiers or model ids."""
+    routing = {**LLM_ROUTING, **((meta or {}).get("llm_routing") or {})}
+    choice = routing.get(task, "flagship")
+    return MODEL_TIERS.get(choice, choice)
+
+
+def model_tier(model: str) -> str:
+    return next((tier for tier, m in MODEL_TIERS.items() if m == model), "custom")
+
+
+def llm_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """USD for one call; 0 for models without a LLM_PRICING entry (e.g. local Ollama)."""
+    price = next((p for prefix, p in LLM_PRICING.items() if model.startswith(prefix)), (0.0, 0.0))
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1e6
+
+
+def llm_tier_report(spans: list[dict]) -> str:
+    """Latency, tokens and cost of LLM calls grouped by tier and model (estimated tokens marked ~)."""
+    rows = {}
+    for sp in spans:
+        if sp["cat"] != "llm":
+            continue
+        row = rows.setdefault((sp.get("tier", "custom"), sp["name"]), {
+            "tasks": set(), "calls": 0, "wall": [], "in": 0, "out": 0, "cost": 0.0, "estimated": False})
+        row["tasks"].add(sp.get("task", "-"))
+        row["calls"] += 1
+        row["wall"].append(sp["end"] - sp["start"])
+        row["in"]   += sp.get("input_tokens", 0)
+        row["out"]  += sp.get("output_tokens", 0)
+        row["cost"] += sp.get("cost_usd", 0.0)
+        row["estimated"] |= sp.get("tokens_estimated", False)
+    if not rows:
+        return "   LLM tiers: no uncached calls"
+    lines = ["   LLM tiers:",
+             f"     {'tier':<9} {'model':<27} {'tasks':<20} {'calls':>5} {'avg':>7} {'max':>7} "
+             f"{'tok in':>9} {'tok out':>9} {'cost':>8}"]
+    for (tier, model), r in sorted(rows.items(), key=lambda kv: -kv[1]["cost"]):
+        est = "~" if r["estimated"] else ""
+        lines.append(f"     {tier:<9} {model[:27]:<27} {','.join(sorted(r['tasks']))[:20]:<20} {r['calls']:>5} "
+                     f"{sum(r['wall']) / r['calls']:6.1f}s {max(r['wall']):6.1f}s "
+                     f"{est + format(r['in'], ','):>9} {est + format(r['out'], ','):>9} {'$' + format(r['cost'], '.3f'):>8}")
+    lines.append(f"     {'total':<9} {'':<27} {'':<20} {sum(r['calls'] for r in rows.values()):>5} "
+                 f"{'':>7} {'':>7} {'':>9} {'':>9} {'$' + format(sum(r['cost'] for r in rows.values()), '.3f'):>8}")
+    return "\n".join(lines)
 
 
 # ─────────────────────────────────────────────
 # LLM CALL (pluggable)
 # ─────────────────────────────────────────────
 
-def call_llm(prompt: str, model: str = "claude-opus-4-5-20251001") -> str:
+def _record_usage(span: dict, model: str, prompt: str, text: str, usage: dict):
+    """Token counts (reported, else estimated) and cost on an llm span."""
+    if "input_tokens" not in usage:
+        usage = {"input_tokens": estimate_tokens(prompt), "output_tokens": estimate_tokens(text)}
+        span["tokens_estimated"] = True
+    span.update(usage)
+    span["cost_usd"] = llm_cost(model, usage["input_tokens"], usage["output_tokens"])
+
+
+def call_llm(prompt: str, model: str = MODEL_TIERS["flagship"], max_tokens: int = 8096, task: str = "-") -> str:
     """
-    Call Anthropic Claude API.
-    Default: Opus for book generation quality.
-    Swap model arg for haiku/sonnet on simpler tasks.
+    Call the configured LLM backend (Anthropic Claude by default).
+    Default: the flagship tier; pipeline call sites pick a model per task with
+    route_model, and `task` labels the call in the tier report.
+    Byte-identical requests are served from LLM_CACHE; the rest go through
+    LLM_DISPATCHER (rate limits, retries, adaptive concurrency).
+    """
+    backend = LLM_BACKEND
+    tier  = model_tier(model)
+    model = backend.resolve_model(model)
+    key = LLM_CACHE.key(f"{backend.name}:{model}", prompt, max_tokens)
+    cached = LLM_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    def request() -> str:
+        usage = {}
+        with PROFILER.span(model, "llm", bytes_in=len(prompt.encode("utf-8")), backend=backend.name,
+                           task=task, tier=tier) as span:
+            text = backend.complete(prompt, model, max_tokens, usage).strip()
+            span["bytes_out"] = len(text.encode("utf-8"))
+            _record_usage(span, model, prompt, text, usage)
+        return text
+
+    text = LLM_DISPATCHER.run(request, estimate_tokens(prompt))
+    LLM_CACHE.put(key, text)
+    return text
+
+
+def call_llm_stream(
+    prompt: str,
+    on_block: Callable[[str, str], None],
+    model: str = MODEL_TIERS["flagship"],
+    max_tokens: int = 8096,
+    task: str = "-",
+) -> str:
+    """
+    Streaming call_llm: on_block(label, content) fires for each labeled code
+    block as soon as its closing fence arrives, so callers can write files or
+    start image generation before the response finishes. Returns the full text.
+    Cache hits replay the cached text through the same parser. A retried
+    stream starts over, but blocks already delivered are not fired again.
+    """
+    backend = LLM_BACKEND
+    tier  = model_tier(model)
+    model = backend.resolve_model(model)
+    key = LLM_CACHE.key(f"{backend.name}:{model}", prompt, max_tokens)
+    cached = LLM_CACHE.get(key)
+    if cached is not None:
+        CodeBlockStream(on_block).feed(cached).close()
+        return cached
+
+    delivered = set()
+
+    def emit(label: str, content: str):
+        if (label, content) not in delivered:
+            delivered.add((label, content))
+            on_block(label, content)
+
+    def request() -> str:
+        parser = CodeBlockStream(emit)
+        parts, usage = [], {}
+        with PROFILER.span(model, "llm", bytes_in=len(prompt.encode("utf-8")), backend=backend.name,
+                           task=task, tier=tier) as span:
+            for chunk in backend.stream(prompt, model, max_tokens, usage):
+                parts.append(chunk)
+                parser.feed(chunk)
+            text = "".join(parts).strip()
+            span["bytes_out"] = len(text.encode("utf-8"))
+            _record_usage(span, model, prompt, text, usage)
+        return text
+
+    text = LLM_DISPATCHER.run(request, estimate_tokens(prompt))
+    LLM_CACHE.put(key, text)
+    return text
+
+
+class CodeBlockStream:
+    """
+    Single-pass tokenizer for LLM output. feed() text in arbitrary chunks:
+    on_block(label, content) fires once per labeled code block as soon as it
+    closes, and [IMAGE: prompt → filename] markers (one line each, inside or
+    outside blocks) are collected on the same pass. After close(), .blocks and
+    .images match parse_code_blocks / parse_image_list on the whole input.
     """
-    import anthropic
-    client = anthropic.Anthropic()  # reads ANTHROPIC_API_KEY from env
-    message = client.messages.create(
-        model=model,
-        max_tokens=8096,
-        messages=[{"role": "user", "content": prompt}],
-    )
-    return message.content[0].text.strip()
+
+    FENCE = "```"
+    MARKER_SCAN_CHARS = 1 << 16   # markers are only read after close(), so scan them in batches
+
+    def __init__(self, on_block: Optional[Callable[[str, str], None]] = None):
+        self.on_block = on_block
+        self.blocks: dict[str, str] = {}
+        self.markers: list[dict]    = []
+        self._buf     = ""
+        self._label   = None   # None while outside a block
+        self._body    = []
+        self._pending = []     # text not yet scanned for markers
+        self._pending_chars = 0
+        self._scan_at = self.MARKER_SCAN_CHARS
+
+    def feed(self, chunk: str) -> "CodeBlockStream":
+        self._pending.append(chunk)
+        self._pending_chars += len(chunk)
+        if self._pending_chars >= self._scan_at:
+            self._scan_markers(complete_lines_only=True)
+
+        buf, pos = self._buf + chunk, 0   # indexes into buf instead of re-slicing it per block
+        while True:
+            idx = buf.find(self.FENCE, pos)
+            if self._label is None:
+                if idx < 0:
+                    self._buf = buf[max(pos, len(buf) - 2):]  # may hold the start of a fence
+                    return self
+                nl = buf.find("\n", idx + 3)
+                if nl < 0:
+                    self._buf = buf[idx:]  # label line not complete yet
+                    return self
+                label = buf[idx + 3:nl]
+                if "`" in label:
+                    pos = idx + 1  # not an opening fence here
+                    continue
+                self._label, self._body, pos = label, [], nl + 1
+            else:
+                if idx < 0:
+                    keep = max(pos, len(buf) - 2)
+                    self._body.append(buf[pos:keep])
+                    self._buf = buf[keep:]
+                    return self
+                self._body.append(buf[pos:idx])
+                label, content = self._label.strip(), "".join(self._body)
+                self._label, self._body, pos = None, [], idx + 3
+                if label:
+                    self.blocks[label] = content
+                    if self.on_block:
+                        self.on_block(label, content)
+
+    def close(self) -> "CodeBlockStream":
+        """End of input: scan whatever is left for markers."""
+        self._scan_markers()
+        return self
+
+    def _scan_markers(self, complete_lines_only: bool = False):
+        text = "".join(self._pending)
+        end = text.rfind("\n") + 1 if complete_lines_only else len(text)
+        self.markers += [{"prompt": prompt, "filename": filename}
+                         for prompt, filename in IMAGE_MARKER_RE.findall(text, 0, end)]
+        self._pending = [text[end:]] if end < len(text) else []
+        self._pending_chars = len(text) - end
+        self._scan_at = max(self.MARKER_SCAN_CHARS, 2 * self._pending_chars)   # one very long line: back off
+
+    @property
+    def images(self) -> list[dict]:
+        """The JSON `images` block if there is a valid one, else the markers."""
+        if "images" in self.blocks:
+            try:
+                return json.loads(self.blocks["images"])
+            except json.JSONDecodeError:
+                pass
+        return list(self.markers)
+
+
+def scan_llm_output(text: str) -> CodeBlockStream:
+    """Tokenize a complete LLM response once; use .blocks and .images."""
+    return CodeBlockStream().feed(text).close()
 
 
 def parse_code_blocks(text: str) -> dict[str, str]:
@@ -165,15 +1433,7 @@ def parse_code_blocks(text: str) -> dict[str, str]:
     Pattern: ```filename\n...\n```
     Returns: {"filename": "content", ...}
     """
-    import re
-    pattern = r"```([^\n`]*)\n(.*?)```"
-    matches = re.findall(pattern, text, re.DOTALL)
-    blocks = {}
-    for label, content in matches:
-        label = label.strip()
-        if label:
-            blocks[label] = content
-    return blocks
+    return scan_llm_output(text).blocks
 
 
 def parse_image_list(text: str) -> list[dict]:
@@ -181,20 +1441,7 @@ def parse_image_list(text: str) -> list[dict]:
     Extract image generation list from LLM output.
     Looks for JSON block labeled 'images' or a list of [IMAGE: prompt → filename] lines.
     """
-    import re
-    # Try JSON block first
-    blocks = parse_code_blocks(text)
-    if "images" in blocks:
-        try:
-            return json.loads(blocks["images"])
-        except json.JSONDecodeError:
-            pass
-
-    # Fallback: parse [IMAGE: prompt → filename] pattern
-    images = []
-    for match in re.finditer(r'\[IMAGE:\s*(.+?)\s*→\s*(\S+)\]', text):
-        images.append({"prompt": match.group(1), "filename": match.group(2)})
-    return images
+    return scan_llm_output(text).images
 
 
 # ─────────────────────────────────────────────
@@ -228,20 +1475,81 @@ For each image needed, insert a marker: [IMAGE: detailed visual description →
 Output ONLY the Markdown manuscript. No preamble, no explanation.
 """
 
-def generate_manuscript(meta: dict) -> str:
-    """Generate full manuscript via LLM."""
+OUTLINE_PROMPT = """You are an expert educational content creator and book author.
+
+BOOK METADATA:
+{yaml_str}
+
+RESEARCH GUIDANCE:
+{research_guidance}
+
+TASK:
+Plan the chapter outline for this book. Target length: {length_guidance}.
+Audience: {audience}. Voice/tone: {voice}. Perspective/framing: {perspective}.
+{glossary_req}
+
+Output ONLY a JSON code block labeled 'outline', in reading order:
+```outline
+[{{"title": "Chapter title", "summary": "2-3 sentences on what the chapter covers"}}]
+```
+"""
+
+CHAPTER_PROMPT = """You are an expert educational content creator and book author.
+
+BOOK METADATA:
+{yaml_str}
+
+RESEARCH GUIDANCE:
+{research_guidance}
+
+FULL OUTLINE (for context and continuity — write ONLY chapter {number}):
+{outline}
+
+TASK:
+Write chapter {number} of {total}: "{title}"
+Chapter scope: {summary}
+
+Requirements:
+- Start with the chapter heading: # {title}
+- Use ## for sections, ### for subsections
+- Write for the specified audience: {audience}
+- Voice/tone: {voice}
+- Perspective/framing: {perspective}
+- Target length: {length_guidance}
+- Pedagogy style: {pedagogy}
+- Do not repeat material that belongs to other chapters in the outline
+{exercises_req}
+{references_req}
+
+For each image needed, insert a marker: [IMAGE: detailed visual description → filename_no_ext]
+Prefix image filenames with ch{number:02d}_ so they are unique across the book.
+
+Output ONLY the Markdown for this chapter. No preamble, no explanation.
+"""
+
+
+def _page_range(meta: dict) -> Optional[tuple[int, int]]:
     length_hint = meta.get("length", "standard")
     if length_hint in LENGTH_PAGES:
-        lo, hi = LENGTH_PAGES[length_hint]
-        length_guidance = f"approximately {lo}-{hi} pages"
+        return LENGTH_PAGES[length_hint]
+    try:
+        n = int(length_hint)
+        return n, n
+    except (ValueError, TypeError):
+        return None
+
+
+def _manuscript_fields(meta: dict) -> dict:
+    """Prompt fields shared by the one-shot, outline and chapter prompts."""
+    pages = _page_range(meta)
+    if pages is None:
+        length_guidance = "standard length"
+    elif pages[0] == pages[1]:
+        length_guidance = f"approximately {pages[0]} pages"
     else:
-        try:
-            n = int(length_hint)
-            length_guidance = f"approximately {n} pages"
-        except (ValueError, TypeError):
-            length_guidance = "standard length"
+        length_guidance = f"approximately {pages[0]}-{pages[1]} pages"
 
-    prompt = MANUSCRIPT_PROMPT.format(
+    return dict(
         yaml_str=yaml.dump(meta, allow_unicode=True),
         research_guidance=DEPTH_TO_RESEARCH.get(meta.get("depth", "standard"), ""),
         audience=meta.get("audience", "general public"),
@@ -255,8 +1563,73 @@ def generate_manuscript(meta: dict) -> str:
                        if meta.get("publication_ready") or meta.get("references", "none") != "none"
                        else "- No references required.",
     )
-    print("  📝 Generating manuscript via LLM...")
-    return call_llm(prompt)
+
+
+def generate_outline(meta: dict) -> list[dict]:
+    """One LLM call → [{"title": ..., "summary": ...}, ...] in reading order."""
+    prompt = OUTLINE_PROMPT.format(**_manuscript_fields(meta))
+    print("  🗂  Generating chapter outline via LLM...")
+    raw = call_llm(prompt, route_model("outline", meta), task="outline")
+    blocks = parse_code_blocks(raw)
+    try:
+        outline = json.loads(blocks.get("outline", raw))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Outline is not valid JSON:\n{raw[:500]}") from e
+    if not isinstance(outline, list) or not outline:
+        raise ValueError(f"Outline must be a non-empty JSON list:\n{raw[:500]}")
+    return outline
+
+
+def generate_manuscript(meta: dict, sharded: bool = False, workers: int = 4) -> str:
+    """
+    Generate full manuscript via LLM.
+    sharded=True: one outline call, then every chapter concurrently on a pool of
+    `workers` threads, reassembled in outline order. Avoids truncating long books
+    at max_tokens and costs roughly one chapter's latency instead of N.
+    """
+    fields = _manuscript_fields(meta)
+    if not sharded:
+        print("  📝 Generating manuscript via LLM...")
+        return call_llm(MANUSCRIPT_PROMPT.format(**fields), route_model("manuscript", meta), task="manuscript")
+
+    outline = generate_outline(meta)
+    total = len(outline)
+    pages = _page_range(meta)
+    if pages:
+        lo, hi = max(1, round(pages[0] / total)), max(1, round(pages[1] / total))
+        fields["length_guidance"] = f"approximately {lo}-{hi} pages" if lo != hi else f"approximately {lo} pages"
+    outline_str = "\n".join(f"{i}. {ch['title']} — {ch.get('summary', '')}" for i, ch in enumerate(outline, 1))
+    print(f"  📝 Generating {total} chapters ({workers} concurrent)...")
+
+    done = [0]
+    lock = threading.Lock()
+
+    def write_chapter(number: int, chapter: dict) -> str:
+        prompt = CHAPTER_PROMPT.format(
+            **fields,
+            outline=outline_str,
+            number=number,
+            total=total,
+            title=chapter["title"],
+            summary=chapter.get("summary", ""),
+        )
+        text = call_llm(prompt, route_model("chapter", meta), task="chapter")
+        if not text.lstrip().startswith("# "):
+            text = f"# {chapter['title']}\n\n{text}"
+        with lock:
+            done[0] += 1
+            print(f"      ✓ [{done[0]}/{total}] {chapter['title']}")
+        return text
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(write_chapter, n, ch) for n, ch in enumerate(outline, 1)]
+        try:
+            chapters = [f.result() for f in futures]
+        except Exception:
+            for f in futures:
+                f.cancel()
+            raise
+    return "\n\n".join(ch.strip() for ch in chapters) + "\n"
 
 
 # ─────────────────────────────────────────────
@@ -331,86 +1704,1221 @@ RULES:
 """
 
 
-def format_for_typst(meta: dict, content: str) -> tuple[str, list[dict]]:
+# Per-chapter variants used by incremental builds: one preamble call plus one
+# call per chapter, so an edit only re-sends the chapters that changed.
+
+TYPST_PREAMBLE_PROMPT = """You are an expert Typst book production engineer for autonomous generation.
+
+YAML METADATA:
+{yaml_str}
+
+CHAPTERS:
+{chapters}
+
+RULES (follow exactly):
+1. Output ONLY the preamble of main.typ as one code block labeled 'typst': imports, #set/#show rules,
+   title page and table of contents. No chapter content — chapter bodies are appended after it.
+2. Use #import "@preview/ilm:2.0.0": * for nonfiction/textbook, or minimal template for fiction.
+3. Add running headers: chapter title left, author right.
+4. Any template #show rule (e.g. #show: ilm.with(...)) must come last so it applies to the appended chapters.
+"""
+
+TYPST_CHAPTER_PROMPT = """You are an expert Typst book production engineer for autonomous generation.
+
+YAML METADATA:
+{yaml_str}
+
+CHAPTER (Markdown):
+{content}
+{part_note}
+
+RULES (follow exactly):
+1. Output this chapter's Typst body as one code block labeled 'typst'. It is spliced into main.typ
+   after a shared preamble: do NOT emit #import, #set or #show rules, or a title page.
+2. Begin with #pagebreak(weak: true), then convert all Markdown headings → Typst headings.
+3. Convert lists, tables, quotes, code blocks to proper Typst syntax.
+4. Place images via: #figure(image("images/FILENAME.png", width: 100%), caption: [Caption])
+5. At end, output a JSON code block labeled 'images' with all images this chapter needs:
+   ```images
+   [{{"filename": "cover", "prompt": "detailed description..."}}]
+   ```
+6. Output ONLY the typst block + the images JSON block. No explanation.
+"""
+
+QUARTO_PREAMBLE_PROMPT = """You are an expert Quarto + Typst book production engineer.
+
+YAML METADATA:
+{yaml_str}
+
+CHAPTER FILES (in order):
+{chapters}
+
+RULES:
+1. Output _quarto.yml and index.qmd as two labeled code blocks: ```_quarto.yml ... ``` ```index.qmd ... ```
+2. Book project with Typst PDF backend. The book chapters list must be exactly index.qmd followed by the chapter files above.
+3. Enable cross-references, citations, math (if present), code highlighting.
+4. index.qmd is the preface/landing page only — chapter content lives in the chapter files.
+5. Output ONLY the two file code blocks. No explanation.
+"""
+
+QUARTO_CHAPTER_PROMPT = """You are an expert Quarto + Typst book production engineer.
+
+YAML METADATA:
+{yaml_str}
+
+CHAPTER (Markdown):
+{content}
+{part_note}
+
+RULES:
+1. Output this chapter as one .qmd file in a code block labeled 'qmd'.
+2. Keep the chapter's # heading as the first line. Use cross-reference labels where useful.
+3. For figures: use standard Quarto figure syntax with images/ paths.
+4. At end, JSON images block:
+   ```images
+   [{{"filename": "fig1", "prompt": "..."}}]
+   ```
+5. Output ONLY the qmd code block + images JSON. No explanation.
+"""
+
+WEASYPRINT_PREAMBLE_PROMPT = """You are an expert print-ready HTML/CSS book formatter for WeasyPrint.
+
+YAML METADATA:
+{yaml_str}
+
+CHAPTERS:
+{chapters}
+
+TRIM SIZE: {trim_size}
+
+RULES:
+1. Output ONLY style.css as one labeled code block: ```style.css ... ```
+2. It styles book.html, whose <body> is a sequence of <section class="chapter"> elements, one per chapter.
+3. Use @page CSS rules for the specified trim size, bleed 0.125in, crop marks.
+4. For kids books: full-bleed spreads, large text, colorful layout.
+5. Use CSS grid/flex for page layouts. Page break before every section.chapter.
+"""
+
+WEASYPRINT_CHAPTER_PROMPT = """You are an expert print-ready HTML/CSS book formatter for WeasyPrint.
+
+YAML METADATA:
+{yaml_str}
+
+CHAPTER (Markdown with [IMAGE: prompt → filename] markers):
+{content}
+{part_note}
+
+TRIM SIZE: {trim_size}
+
+RULES:
+1. Output this chapter as one code block labeled 'html' containing a single <section class="chapter"> element.
+   No <html>, <head>, <body> or <style> — a shared stylesheet is applied.
+2. Replace [IMAGE: prompt → filename] with: <img src="images/filename.png" alt="prompt">
+3. Structure spreads with semantic elements and classes a book stylesheet can target.
+4. At end, JSON images block:
+   ```images
+   [{{"filename": "spread1", "prompt": "..."}}]
+   ```
+5. Output ONLY the html code block + images JSON.
+"""
+
+WEASYPRINT_HTML_SHELL = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<link rel="stylesheet" href="style.css">
+</head>
+<body>
+{sections}
+</body>
+</html>
+"""
+
+
+def _format_llm(prompt: str, on_block: Optional[Callable[[str, str], None]], meta: dict, task: str = "format") -> str:
+    model = route_model(task, meta)
+    return call_llm_stream(prompt, on_block, model, task=task) if on_block else call_llm(prompt, model, task=task)
+
+
+def _warn_if_oversized(content: str, chunk_tokens: int):
+    tokens = estimate_tokens(content)
+    if tokens > chunk_tokens:
+        print(f"  ⚠️  Manuscript is ~{tokens:,} tokens in one format call (budget ~{chunk_tokens:,}); "
+              "output may be truncated — drop --no-incremental to format in chunks")
+
+
+def format_for_typst(
+    meta: dict,
+    content: str,
+    state: Optional["BuildState"] = None,
+    on_block: Optional[Callable[[str, str], None]] = None,
+    workers: int = 4,
+    chunk_tokens: int = FORMAT_CHUNK_TOKENS,
+) -> tuple[str, list[dict]]:
+    if state is not None:
+        preamble, fragments, images = format_chapters("typst", meta, content, state, on_block, workers, chunk_tokens)
+        return "\n\n".join([preamble["typst"], *fragments]) + "\n", images
     prompt = TYPST_FORMAT_PROMPT.format(yaml_str=yaml.dump(meta), content=content)
     print("  🔧 Formatting for Typst...")
-    raw = call_llm(prompt)
-    blocks = parse_code_blocks(raw)
-    typst_content = blocks.get("typst", raw)  # fallback to full output
-    images = parse_image_list(raw)
-    return typst_content, images
+    _warn_if_oversized(content, chunk_tokens)
+    raw = _format_llm(prompt, on_block, meta)
+    output = scan_llm_output(raw)
+    typst_content = output.blocks.get("typst") or typst_preamble(meta) + "\n" + markdown_to_typst(content)
+    return typst_content, output.images
 
 
-def format_for_quarto(meta: dict, content: str) -> tuple[dict[str, str], list[dict]]:
+def format_for_quarto(
+    meta: dict,
+    content: str,
+    state: Optional["BuildState"] = None,
+    on_block: Optional[Callable[[str, str], None]] = None,
+    workers: int = 4,
+    chunk_tokens: int = FORMAT_CHUNK_TOKENS,
+) -> tuple[dict[str, str], list[dict]]:
+    if state is not None:
+        preamble, fragments, images = format_chapters("quarto", meta, content, state, on_block, workers, chunk_tokens)
+        files = quarto_chapter_files(split_chapters(content))
+        return {**preamble, **dict(zip(files, fragments))}, images
     prompt = QUARTO_FORMAT_PROMPT.format(yaml_str=yaml.dump(meta), content=content)
     print("  🔧 Formatting for Quarto...")
-    raw = call_llm(prompt)
-    blocks = parse_code_blocks(raw)
-    images = parse_image_list(raw)
+    _warn_if_oversized(content, chunk_tokens)
+    raw = _format_llm(prompt, on_block, meta)
+    output = scan_llm_output(raw)
+    blocks = output.blocks
+    images = output.images
+    blocks.pop("images", None)  # image list, not a project file
     return blocks, images
 
 
-def format_for_weasyprint(meta: dict, content: str) -> tuple[str, str, list[dict]]:
+def format_for_weasyprint(
+    meta: dict,
+    content: str,
+    state: Optional["BuildState"] = None,
+    on_block: Optional[Callable[[str, str], None]] = None,
+    workers: int = 4,
+    chunk_tokens: int = FORMAT_CHUNK_TOKENS,
+) -> tuple[str, str, list[dict]]:
+    if state is not None:
+        preamble, fragments, images = format_chapters("weasyprint", meta, content, state, on_block, workers, chunk_tokens)
+        html = WEASYPRINT_HTML_SHELL.format(title=meta.get("title", "Book"), sections="\n\n".join(fragments))
+        return html, preamble["style.css"], images
     prompt = WEASYPRINT_FORMAT_PROMPT.format(
         yaml_str=yaml.dump(meta),
         content=content,
         trim_size=meta.get("trim_size", "8.5x11"),
     )
     print("  🔧 Formatting for WeasyPrint...")
-    raw = call_llm(prompt)
-    blocks = parse_code_blocks(raw)
+    _warn_if_oversized(content, chunk_tokens)
+    raw = _format_llm(prompt, on_block, meta)
+    output  = scan_llm_output(raw)
+    blocks  = output.blocks
     html    = blocks.get("html", blocks.get("book.html", ""))
     css     = blocks.get("css",  blocks.get("style.css", ""))
-    images  = parse_image_list(raw)
+    images  = output.images
     return html, css, images
 
 
+# ─────────────────────────────────────────────
+# NATIVE FORMATTING (Markdown → Typst / Quarto without an LLM)
+# ─────────────────────────────────────────────
+
+FORMATTERS = ("auto", "native", "hybrid", "llm")   # hybrid: native body + LLM-written preamble (styling)
+
+TYPST_ESCAPE_RE  = re.compile(r"([\\#$*_`<>@\[\]~])")
+TYPST_INLINE_RE  = re.compile(r"`([^`]+)`|\*\*([^*]+)\*\*|\*([^*]+)\*|\[([^\]]+)\]\(([^)\s]+)\)")
+TYPST_LINE_START_RE = re.compile(r"^(\s*)([=+/-]|\d+\.(?=\s))")
+DEEP_HEADING_RE  = re.compile(r"^(#{4,6}) (.+)$")   # markdown_blocks stops at ###
+HRULE_RE         = re.compile(r"^\s*(-{3,}|\*{3,}|_{3,})\s*$")
+TYPST_SLASH_RE   = re.compile(r"/(?=[/*])")   # would open a comment
+FIGURE_LABEL_RE  = re.compile(r"[^\w-]")
+SENTENCE_END_RE  = re.compile(r"(?<=[.!?])\s")
+MARKDOWN_ESCAPE_RE = re.compile(r"([\\`*_\[\]<>])")
+QUARTO_PAPERSIZES = {"6x9": "us-trade", "8.5x11": "us-letter", "letter": "us-letter"}   # Typst paper names
+
+TYPST_NATIVE_PREAMBLE = """#set document(title: {title_str}, author: {author_str})
+#set page(
+  width: {width}in,
+  height: {height}in,
+  margin: (inside: 0.875in, outside: 0.625in, top: 0.8in, bottom: 0.8in),
+  numbering: "1",
+  header: context {{
+    let openers = query(heading.where(level: 1)).filter(h => h.location().page() == here().page())
+    let before = query(heading.where(level: 1).before(here()))
+    if openers.len() == 0 and before.len() > 0 {{
+      set text(size: 9pt)
+      emph(before.last().body)
+      h(1fr)
+      [{author}]
+    }}
+  }},
+)
+#set text(size: 11pt, lang: "en")
+#set par(justify: true{par_extra})
+#show heading.where(level: 1): it => {{
+  v(1.5in)
+  text(size: 22pt, weight: "bold", it.body)
+  v(1em)
+}}
+#show raw.where(block: true): block.with(fill: luma(245), inset: 8pt, radius: 3pt, width: 100%)
+#show link: underline
+
+#page(header: none, numbering: none)[
+  #align(center + horizon)[
+    #text(size: 28pt, weight: "bold")[{title}]
+    {subtitle_line}
+    #v(2em)
+    #text(size: 14pt)[{author}]
+  ]
+]
+#page(header: none, numbering: none, outline(depth: 2, indent: auto))
+"""
+
+
+def typst_escape(text: str) -> str:
+    """Plain text → Typst markup that renders literally (no markup, math, labels or comments)."""
+    return TYPST_SLASH_RE.sub(r"\\/", TYPST_ESCAPE_RE.sub(r"\\\1", text))
+
+
+def _typst_str(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def typst_inline(text: str) -> str:
+    """Inline Markdown (`code`, **bold**, *italic*, [links](url)) → Typst, escaping everything else."""
+    out, pos = [], 0
+    for m in TYPST_INLINE_RE.finditer(text):
+        out.append(typst_escape(text[pos:m.start()]))
+        code, bold, italic, label, url = m.groups()
+        if code is not None:
+            out.append(f"#raw({_typst_str(code)})")
+        elif bold is not None:
+            out.append(f"#strong[{typst_escape(bold)}]")
+        elif italic is not None:
+            out.append(f"#emph[{typst_escape(italic)}]")
+        else:
+            out.append(f"#link({_typst_str(url)})[{typst_escape(label)}]")
+        pos = m.end()
+    out.append(typst_escape(text[pos:]))
+    return "".join(out)
+
+
+def _typst_figure(prompt: str, filename: str) -> str:
+    return f'#figure(image("images/{filename}.png", width: 100%, alt: {_typst_str(prompt)}))'
+
+
+def markdown_to_typst(content: str) -> str:
+    """
+    Deterministic Markdown → Typst body using the shared markdown_blocks
+    tokenizer: headings, paragraphs, lists, quotes, tables, code blocks,
+    rules and [IMAGE: prompt → filename] markers (as figures). Level-1
+    headings start on a new page; `####`–`######` (plain text to the
+    tokenizer) become deeper headings. A fence left open at the end is closed.
+    """
+    out, rows, quote = [], [], []
+    in_code = False
+
+    def flush_table():
+        if not rows:
+            return
+        cols = max(len(cells) for cells, _ in rows)
+        cell = lambda c: f"[{typst_inline(c)}]"
+        pad = lambda cells: list(cells) + [""] * (cols - len(cells))
+        out.append(f"#table(\n  columns: {cols},")
+        for cells, header in rows:
+            row = ", ".join(cell(c) for c in pad(cells))
+            out.append(f"  table.header({row})," if header else f"  {row},")
+        out.append(")")
+        rows.clear()
+
+    def flush_quote():
+        if quote:
+            out.append(f"#quote(block: true)[{' '.join(typst_inline(q) for q in quote)}]")
+            quote.clear()
+
+    for line in tokenize(content):
+        if line.kind == "table_sep":
+            if len(rows) == 1:
+                rows[0] = (rows[0][0], True)   # the row above a separator is the header
+            continue
+        if line.kind != "table_row":
+            flush_table()
+        if line.kind != "quote":
+            flush_quote()
+
+        deep = DEEP_HEADING_RE.match(line.raw) if line.kind == "text" else None
+        if line.kind == "fence":
+            in_code = bool(line.level)
+            out.append(f"```{line.text}" if line.level else "```")
+        elif deep:
+            out.append(f"{'=' * len(deep.group(1))} {typst_inline(deep.group(2))}")
+        elif line.kind == "code":
+            out.append(line.raw)
+        elif line.kind == "heading":
+            if line.level == 1:
+                out.append("#pagebreak(weak: true)")
+            out.append(f"{'=' * line.level} {typst_inline(line.text)}")
+        elif line.kind == "quote":
+            quote.append(line.text)
+        elif line.kind == "table_row":
+            rows.append((line.cells, False))
+        elif line.kind == "bullet":
+            out.append(f"{'  ' * (line.level // 2)}- {typst_inline(line.text)}")
+        elif line.kind == "number":
+            out.append(f"+ {typst_inline(line.text)}")
+        elif line.kind == "blank":
+            out.append("")
+        elif HRULE_RE.match(line.raw):
+            out.append("#line(length: 100%)")
+        else:
+            parts = IMAGE_MARKER_RE.split(line.raw)   # [text, prompt, filename, text, ...]
+            for i in range(0, len(parts), 3):
+                if parts[i].strip():
+                    out.append(TYPST_LINE_START_RE.sub(r"\1\\\2", typst_inline(parts[i].strip())))
+                if i + 2 < len(parts):
+                    out.append(_typst_figure(parts[i + 1], parts[i + 2]))
+    flush_table()
+    flush_quote()
+    if in_code:
+        out.append("```")   # unterminated fence: close the raw block so the document still compiles
+    return "\n".join(out).strip() + "\n"
+
+
+def typst_preamble(meta: dict) -> str:
+    """Self-contained main.typ preamble from metadata: page size, running headers, title page, contents."""
+    width, height = TRIM_SIZES_IN.get(meta.get("trim_size", "6x9"), TRIM_SIZES_IN["6x9"])
+    title    = str(meta.get("title", "Book"))
+    author   = str(meta.get("author", "Unknown"))
+    subtitle = str(meta.get("subtitle") or "")
+    fiction  = str(meta.get("book_type", "")).lower() in {"fiction", "novel"}
+    return TYPST_NATIVE_PREAMBLE.format(
+        title_str=_typst_str(title),
+        author_str=_typst_str(author),
+        title=typst_escape(title),
+        author=typst_escape(author),
+        subtitle_line=f"#v(0.5em)\n    #text(size: 16pt)[{typst_escape(subtitle)}]" if subtitle else "",
+        width=width,
+        height=height,
+        par_extra=", first-line-indent: 1.2em" if fiction else "",
+    )
+
+
+def format_typst_native(meta: dict, content: str, styled: bool = False) -> tuple[str, list[dict]]:
+    """
+    main.typ without a formatting LLM call: the built-in preamble (or, with
+    styled=True, an LLM-written one — cached like any other call) plus the
+    natively converted body. Images come from the manuscript's markers.
+    """
+    print(f"  🔧 Formatting for Typst (native{' + LLM styling' if styled else ''})...")
+    with PROFILER.span("markdown→typst", "format", bytes_in=len(content.encode("utf-8"))) as span:
+        body = markdown_to_typst(content)
+        span["bytes_out"] = len(body.encode("utf-8"))
+    if styled:
+        listing = "\n".join(f"{i}. {chapter_title(ch)}" for i, ch in enumerate(split_chapters(content), 1))
+        raw = _format_llm(TYPST_PREAMBLE_PROMPT.format(yaml_str=yaml.dump(meta), chapters=listing),
+                          None, meta, task="preamble")
+        preamble = parse_code_blocks(raw).get("typst") or typst_preamble(meta)
+    else:
+        preamble = typst_preamble(meta)
+    return preamble.rstrip() + "\n\n" + body, manuscript_images(content)
+
+
+def manuscript_images(content: str) -> list[dict]:
+    """[IMAGE: prompt → filename] markers in the manuscript, skipping fenced code."""
+    return [{"prompt": prompt, "filename": filename}
+            for line in tokenize(content) if line.kind not in ("fence", "code")
+            for prompt, filename in IMAGE_MARKER_RE.findall(line.raw)]
+
+
+def _figure_caption(prompt: str, limit: int = 80) -> str:
+    """Short visible caption: the prompt's first sentence, cut at a word boundary."""
+    caption = SENTENCE_END_RE.split(prompt.strip(), 1)[0]
+    if len(caption) > limit:
+        caption = caption[:limit].rsplit(" ", 1)[0].rstrip(",;:") + "…"
+    return MARKDOWN_ESCAPE_RE.sub(r"\\\1", caption)
+
+
+def _quarto_figure(prompt: str, filename: str, labels: set[str]) -> str:
+    """
+    Labelled figure with a short caption (so cross-references read "Figure N");
+    the full generation prompt is the alt text. labels holds the labels used
+    so far in the book, so an image placed twice gets #fig-NAME-2.
+    """
+    base = label = FIGURE_LABEL_RE.sub("-", filename)
+    n = 1
+    while label in labels:
+        n += 1
+        label = f"{base}-{n}"
+    labels.add(label)
+    alt = prompt.replace("\\", "\\\\").replace('"', '\\"')
+    return f'![{_figure_caption(prompt)}](images/{filename}.png){{#fig-{label} fig-alt="{alt}"}}'
+
+
+def markdown_to_qmd(chapter: str, labels: Optional[set[str]] = None) -> str:
+    """
+    One chapter's Markdown → .qmd: Markdown is already Quarto's input, so only
+    [IMAGE: prompt → filename] markers (outside code) become cross-referenceable
+    figures, each in a paragraph of its own. Share `labels` across a book's
+    chapters to keep figure labels unique.
+    """
+    labels = set() if labels is None else labels
+    out = []
+    for line in tokenize(chapter):
+        if line.kind in ("fence", "code") or "[IMAGE:" not in line.raw:
+            out.append(line.raw)
+        else:
+            parts = IMAGE_MARKER_RE.split(line.raw)   # [text, prompt, filename, text, ...]
+            pieces = [parts[0].rstrip()] if parts[0].strip() else []
+            for i in range(1, len(parts), 3):
+                pieces.append(_quarto_figure(parts[i], parts[i + 1], labels))
+                if parts[i + 2].strip():
+                    pieces.append(parts[i + 2].strip())
+            out.append("\n\n".join(pieces))
+    return "\n".join(out)
+
+
+def quarto_yml(meta: dict, chapter_files: list[str]) -> str:
+    """_quarto.yml for a Typst-backed Quarto book whose chapters are index.qmd + chapter_files."""
+    book = {"title": str(meta.get("title", "Book"))}
+    for key in ("subtitle", "author", "date"):
+        if meta.get(key):
+            book[key] = str(meta[key])
+    book["chapters"] = ["index.qmd", *chapter_files]
+    typst = {"toc": True, "number-sections": True, "section-numbering": "1.1"}
+    if meta.get("trim_size", "8.5x11") in QUARTO_PAPERSIZES:
+        typst["papersize"] = QUARTO_PAPERSIZES[meta.get("trim_size", "8.5x11")]
+    config = {"project": {"type": "book"}, "book": book}
+    if meta.get("bibliography"):
+        config["bibliography"] = meta["bibliography"]
+        if meta.get("csl"):   # a .csl file path; citation_style is a name (APA, MLA...), not a CSL file
+            config["csl"] = meta["csl"]
+    config["format"] = {"typst": typst}
+    return yaml.dump(config, allow_unicode=True, sort_keys=False)
+
+
+def quarto_index(meta: dict, front_matter: str = "", labels: Optional[set[str]] = None) -> str:
+    """index.qmd: the manuscript's text before its first chapter, else the description/subtitle."""
+    intro = front_matter.strip() or str(meta.get("description") or meta.get("subtitle") or "")
+    return f"# Preface {{.unnumbered}}\n\n{markdown_to_qmd(intro, labels)}\n" if intro else "# Preface {.unnumbered}\n"
+
+
+def format_quarto_native(meta: dict, content: str, styled: bool = False) -> tuple[dict[str, str], list[dict]]:
+    """
+    Quarto project files without a formatting LLM call: one .qmd per `#`
+    chapter (named by quarto_chapter_files), index.qmd and _quarto.yml from
+    metadata. styled=True asks the LLM for _quarto.yml + index.qmd instead.
+    """
+    print(f"  🔧 Formatting for Quarto (native{' + LLM styling' if styled else ''})...")
+    with PROFILER.span("markdown→quarto", "format", bytes_in=len(content.encode("utf-8"))) as span:
+        chapters = split_chapters(content)
+        front = ""
+        if chapters:   # text before the first chapter heading (outside code) is the preface
+            first = next((i for i, line in enumerate(tokenize(chapters[0]))
+                          if line.kind == "heading" and line.level == 1), None)
+            lines = chapters[0].split("\n")
+            if first is None:
+                front, chapters = chapters[0], []
+            elif first:
+                front, chapters[0] = "\n".join(lines[:first]), "\n".join(lines[first:])
+        names = quarto_chapter_files(chapters)
+        labels = set()   # figure labels are book-wide
+        files = {name: markdown_to_qmd(chapter, labels).rstrip() + "\n" for name, chapter in zip(names, chapters)}
+        span["bytes_out"] = sum(len(text.encode("utf-8")) for text in files.values())
+    if styled:
+        raw = _format_llm(QUARTO_PREAMBLE_PROMPT.format(yaml_str=yaml.dump(meta), chapters="\n".join(names)),
+                          None, meta, task="preamble")
+        blocks = parse_code_blocks(raw)
+    else:
+        blocks = {}
+    preamble = {
+        "_quarto.yml": blocks.get("_quarto.yml") or quarto_yml(meta, names),
+        "index.qmd":   blocks.get("index.qmd") or quarto_index(meta, front, labels),
+    }
+    return {**preamble, **files}, manuscript_images(content)
+
+
+# ─────────────────────────────────────────────
+# INCREMENTAL FORMATTING (per-chapter build state)
+# ─────────────────────────────────────────────
+
+BUILD_STATE_FILE = ".build_state.json"
+
+# engine → (preamble prompt, chapter prompt, fragment block label, preamble block labels)
+CHAPTER_FORMATS = {
+    "typst":      (TYPST_PREAMBLE_PROMPT,      TYPST_CHAPTER_PROMPT,      "typst", ("typst",)),
+    "quarto":     (QUARTO_PREAMBLE_PROMPT,     QUARTO_CHAPTER_PROMPT,     "qmd",   ("_quarto.yml", "index.qmd")),
+    "weasyprint": (WEASYPRINT_PREAMBLE_PROMPT, WEASYPRINT_CHAPTER_PROMPT, "html",  ("style.css",)),
+}
+
+
+def _sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def split_chapters(manuscript: str) -> list[str]:
+    """Split a manuscript at top-level `# ` headings (ignoring fenced code). Front matter joins chapter 1."""
+    chapters, current, in_code, has_heading = [], [], False, False
+    for line in manuscript.splitlines(keepends=True):
+        if line.startswith("```"):
+            in_code = not in_code
+        heading = not in_code and line.startswith("# ")
+        if heading and has_heading:
+            chapters.append("".join(current))
+            current, has_heading = [], False
+        current.append(line)
+        has_heading = has_heading or heading
+    if current:
+        chapters.append("".join(current))
+    return chapters
+
+
+def chapter_title(chapter: str) -> str:
+    for line in tokenize(chapter):
+        if line.kind == "heading" and line.level == 1:
+            return line.text.strip()
+    return "Untitled"
+
+
+def quarto_chapter_files(chapters: list[str]) -> list[str]:
+    names = []
+    for i, ch in enumerate(chapters, 1):
+        slug = "".join(c if c.isalnum() else "-" for c in chapter_title(ch).lower()).strip("-")
+        slug = "-".join(part for part in slug.split("-") if part)[:40] or "chapter"
+        names.append(f"{i:02d}-{slug}.qmd")
+    return names
+
+
+class BuildState:
+    """
+    Per-output-dir record of the last formatted build (.build_state.json):
+    engine, metadata hash, preamble, and for each chunk (a chapter, or part of
+    a long one) the hash of its Markdown, its formatted fragment (+ hash), its
+    chapter index and its image list.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        try:
+            self.data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            self.data = {}
+
+    def reusable(self, engine: str, meta_hash: str) -> tuple[Optional[dict], dict[str, dict]]:
+        """(preamble entry, {chunk source hash: chunk entry}) from a build with the same engine + metadata."""
+        if self.data.get("engine") != engine or self.data.get("meta") != meta_hash:
+            return None, {}
+        return self.data.get("preamble"), {ch["source"]: ch for ch in self.data.get("chapters", [])}
+
+    def save(self, engine: str, meta_hash: str, preamble: dict, chapters: list[dict]):
+        self.data = {"engine": engine, "meta": meta_hash, "preamble": preamble, "chapters": chapters}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.data, indent=1, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English prose and markup)."""
+    return (len(text) + 3) // 4
+
+
+def _split_at(text: str, prefix: str) -> list[str]:
+    """Split before every line starting with `prefix` (outside fenced code)."""
+    pieces, current, in_code = [], [], False
+    for line in text.splitlines(keepends=True):
+        if line.startswith("```"):
+            in_code = not in_code
+        if not in_code and line.startswith(prefix) and current:
+            pieces.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+
+def chunk_chapter(chapter: str, budget: int) -> list[str]:
+    """
+    Split one chapter into pieces of at most ~budget tokens, preferring
+    ## then ### boundaries, then blank lines. Adjacent small pieces are packed
+    back together; a single oversized paragraph stays whole. No chunk is only
+    whitespace or only headings (see _fold_chunks).
+    """
+    if estimate_tokens(chapter) <= budget:
+        return [chapter]
+    for prefix in ("## ", "### ", "\n"):
+        pieces = _split_at(chapter, prefix)
+        if len(pieces) > 1:
+            break
+    else:
+        return [chapter]
+
+    chunks, current = [], ""
+    for piece in pieces:
+        if current and estimate_tokens(current + piece) > budget:
+            chunks.append(current)
+            current = ""
+        current += piece
+    chunks.append(current)
+    # recurse into any piece still over budget (e.g. one huge ## section)
+    return _fold_chunks([sub for chunk in chunks
+                         for sub in (chunk_chapter(chunk, budget) if chunk != chapter else [chunk])])
+
+
+def _fold_chunks(chunks: list[str]) -> list[str]:
+    """
+    Merge chunks that would make pointless LLM calls: whitespace-only chunks
+    join the previous one, and heading-only chunks join the body that follows
+    (or, at the end, the previous one). May exceed the budget by those lines.
+    """
+    def heading_only(chunk: str) -> bool:
+        kinds = {line.kind for line in tokenize(chunk)} - {"blank"}
+        return kinds == {"heading"}
+
+    folded, carry = [], ""
+    for chunk in chunks:
+        chunk = carry + chunk
+        carry = ""
+        if not chunk.strip():
+            if folded:
+                folded[-1] += chunk
+            else:
+                carry = chunk
+        elif heading_only(chunk):
+            carry = chunk
+        else:
+            folded.append(chunk)
+    if carry:
+        if folded:
+            folded[-1] += carry
+        else:
+            folded.append(carry)
+    return folded
+
+
+def _part_note(part: int, parts: int) -> str:
+    if parts == 1:
+        return ""
+    if part == 1:
+        return (f"NOTE: This is part 1 of {parts} of one chapter, split to fit output limits. "
+                "Later parts are formatted separately and appended — do not add a conclusion.")
+    return (f"NOTE: This is part {part} of {parts} of one chapter, split to fit output limits. "
+            "Continue it seamlessly: no page break, and do not repeat the chapter heading.")
+
+
+def format_chapters(
+    engine: str,
+    meta: dict,
+    content: str,
+    state: BuildState,
+    on_block: Optional[Callable[[str, str], None]] = None,
+    workers: int = 4,
+    chunk_tokens: int = FORMAT_CHUNK_TOKENS,
+) -> tuple[dict[str, str], list[str], list[dict]]:
+    """
+    Format a manuscript chapter by chapter, re-sending only chunks whose
+    Markdown changed since the last build recorded in `state`.
+    Chapters larger than chunk_tokens are split at heading boundaries; dirty
+    chunks are formatted concurrently on `workers` threads and stitched back
+    in order. on_block sees every streamed code block; reused chunks replay
+    their images block.
+    Returns (preamble blocks, one formatted fragment per chapter, combined image list).
+    """
+    preamble_prompt, chapter_prompt, label, preamble_labels = CHAPTER_FORMATS[engine]
+    yaml_str  = yaml.dump(meta)
+    meta_hash = _sha(yaml_str)
+    trim_size = meta.get("trim_size", "8.5x11")
+    chapters  = split_chapters(content)
+    if engine == "quarto":
+        listing = "\n".join(quarto_chapter_files(chapters))
+    else:
+        listing = "\n".join(f"{i}. {chapter_title(ch)}" for i, ch in enumerate(chapters, 1))
+
+    # (chapter index, chunk markdown, part note) in reading order
+    units = []
+    for c, chapter in enumerate(chapters):
+        parts = [part for part in chunk_chapter(chapter, chunk_tokens) if part.strip()]
+        units += [(c, chunk, _part_note(k, len(parts))) for k, chunk in enumerate(parts, 1)]
+
+    prior_preamble, prior = state.reusable(engine, meta_hash)
+    sources = [_sha(note + chunk) for _, chunk, note in units]
+    dirty = [i for i, h in enumerate(sources) if h not in prior]
+    print(f"  🔧 Formatting for {engine}: {len(dirty)}/{len(units)} chunk(s) changed "
+          f"across {len(chapters)} chapter(s), budget ~{chunk_tokens:,} tokens/chunk")
+    for i, (c, chunk, _) in enumerate(units):
+        status = "changed" if i in dirty else "cached"
+        print(f"      {i + 1:>3}. ch{c + 1:02d} {chapter_title(chapters[c])[:40]:<40} ~{estimate_tokens(chunk):>6,} tokens  {status}")
+
+    preamble_hash = _sha(listing)
+    if prior_preamble and prior_preamble.get("hash") == preamble_hash:
+        preamble = prior_preamble
+    else:
+        raw = _format_llm(preamble_prompt.format(yaml_str=yaml_str, chapters=listing, trim_size=trim_size),
+                          on_block, meta, task="preamble")
+        blocks = parse_code_blocks(raw)
+        preamble = {"hash": preamble_hash, "blocks": {name: blocks.get(name, "") for name in preamble_labels}}
+        # A block the response left out: use the native version where there is one
+        fallbacks = {
+            "typst":       lambda: typst_preamble(meta),
+            "_quarto.yml": lambda: quarto_yml(meta, quarto_chapter_files(chapters)),
+            "index.qmd":   lambda: quarto_index(meta),
+        }
+        for name, text in preamble["blocks"].items():
+            if not text.strip() and name in fallbacks:
+                preamble["blocks"][name] = fallbacks[name]()
+        if not all(text.strip() for text in preamble["blocks"].values()):
+            preamble["hash"] = None   # still incomplete: ask again next build rather than reuse it
+
+    entries = [None] * len(units)
+    for i, source in enumerate(sources):
+        if source in prior:
+            entries[i] = {**prior[source], "chapter": units[i][0]}
+            if on_block and prior[source]["images"]:
+                on_block("images", json.dumps(prior[source]["images"]))
+
+    def format_unit(i: int) -> dict:
+        c, chunk, note = units[i]
+        prompt = chapter_prompt.format(yaml_str=yaml_str, content=chunk, part_note=note, trim_size=trim_size)
+        raw = _format_llm(prompt, on_block, meta)
+        output = scan_llm_output(raw)
+        formatted = output.blocks.get(label)
+        if formatted is None:   # no code block: convert natively rather than splice in prose
+            formatted = {"typst": markdown_to_typst, "quarto": markdown_to_qmd}.get(engine, lambda _: raw)(chunk)
+        print(f"      ✓ chunk {i + 1}/{len(units)}")
+        return {
+            "source":    sources[i],
+            "chapter":   c,
+            "output":    _sha(formatted),
+            "formatted": formatted,
+            "images":    output.images,
+        }
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {i: pool.submit(format_unit, i) for i in dirty}
+        try:
+            for i, fut in futures.items():
+                entries[i] = fut.result()
+        except Exception:
+            for fut in futures.values():
+                fut.cancel()
+            raise
+
+    state.save(engine, meta_hash, preamble, entries)
+    fragments = [
+        "\n\n".join(entry["formatted"] for entry in entries if entry["chapter"] == c)
+        for c in range(len(chapters))
+    ]
+    images, seen = [], set()
+    for img in (img for entry in entries for img in entry["images"]):
+        if img["filename"] not in seen:  # first chunk to declare a filename wins
+            seen.add(img["filename"])
+            images.append(img)
+    return preamble["blocks"], fragments, images
+
+
 # ─────────────────────────────────────────────
 # COMPILERS
 # ─────────────────────────────────────────────
 
-def compile_typst(typst_content: str, out_pdf: Path):
-    """Write .typ file and compile to PDF."""
-    with tempfile.NamedTemporaryFile(suffix=".typ", delete=False, mode="w", encoding="utf-8") as f:
-        f.write(typst_content)
-        tmp = Path(f.name)
+def _run_compiler(name: str, cmd: list[str], bytes_in: int, output: Path,
+                  cwd: Optional[Path] = None, cat: str = "compile"):
+    """Run a compiler/converter as a profiled span; raises CalledProcessError like check=True."""
+    with concurrency_slot("compile"), PROFILER.span(name, cat, bytes_in=bytes_in) as span:
+        returncode, _, _ = run_command(cmd, span, cwd=cwd)
+        if output.is_dir():
+            span["bytes_out"] = sum(_file_size(f) for f in output.rglob("*") if f.is_file())
+        else:
+            span["bytes_out"] = _file_size(output)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+
+def write_if_changed(path: Path, content: str) -> bool:
+    """Write `content` only if it differs from what is on disk, so mtimes (and compiler caches) survive."""
     try:
-        subprocess.run(["typst", "compile", str(tmp), str(out_pdf)], check=True)
-    finally:
-        tmp.unlink(missing_ok=True)
+        if path.read_text(encoding="utf-8") == content:
+            return False
+    except (OSError, UnicodeDecodeError):
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding="utf-8")
+    return True
+
+
+def _link_images_dir(project_dir: Path, images_dir: Path = IMAGES_DIR):
+    """Expose images_dir inside a project dir as images/ (symlink) so relative image paths resolve."""
+    link = project_dir / "images"
+    target = images_dir.resolve()
+    if link.is_symlink() and link.resolve() == target:
+        return
+    if link.is_symlink() or link.is_file():
+        link.unlink()
+    if not link.exists():
+        images_dir.mkdir(parents=True, exist_ok=True)
+        link.symlink_to(target, target_is_directory=True)
+
+
+TYPST_IMAGE_RE = re.compile(r'image\(\s*"([^"]+)"')
+
+
+def _process_identity(pid: int) -> Optional[str]:
+    """Start time + command line of a running process (None if gone or a zombie), to tell a recycled PID apart."""
+    try:
+        out = subprocess.run(["ps", "-o", "lstart=", "-o", "command=", "-p", str(pid)],
+                             capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out if out and "<defunct>" not in out else None
+
+
+class TypstWatch:
+    """
+    A detached `typst watch` process per project dir that outlives the CLI.
+    Typst keeps its incremental compilation state, loaded fonts and the
+    @preview/ilm package in memory, so a rebuild after a small edit only
+    rewrites main.typ and waits for the watcher to report the recompile.
+    State lives in project_dir/.watch.json (PID plus its start time and
+    command line, so a recycled PID is never trusted or signalled),
+    compiler output in .watch.log.
+    """
+
+    _procs: dict[int, subprocess.Popen] = {}   # watchers started by this process: poll() instead of ps
+
+    def __init__(self, project_dir: Path, out_pdf: Path):
+        self.project_dir = project_dir
+        self.out_pdf     = out_pdf.resolve()
+        self.main        = project_dir / "main.typ"
+        self.state_file  = project_dir / ".watch.json"
+        self.log_file    = project_dir / ".watch.log"
+
+    def _live_state(self) -> Optional[dict]:
+        try:
+            state = json.loads(self.state_file.read_text())
+            pid = state["pid"]
+        except (OSError, ValueError, KeyError):
+            return None
+        proc = self._procs.get(pid)
+        if proc is not None:
+            return state if proc.poll() is None else None   # poll() also reaps an exited child
+        identity = state.get("identity")
+        return state if identity and _process_identity(pid) == identity else None
+
+    def pid(self) -> Optional[int]:
+        """PID of a live watcher for this project and output, else None."""
+        state = self._live_state()
+        return state["pid"] if state and state.get("out_pdf") == str(self.out_pdf) else None
+
+    def _log_size(self) -> int:
+        return _file_size(self.log_file)
+
+    def _wait_for_compile(self, offset: int, timeout: float = 300):
+        """Block until the log shows a compile finishing after byte `offset`; raise on errors."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            alive = self.pid() is not None   # checked first, so an exit's last output is in the read below
+            with open(self.log_file, encoding="utf-8", errors="replace") as f:
+                f.seek(offset)
+                new = f.read()
+            for line in new.splitlines():
+                if "compiled" in line.lower():
+                    if "error" in line.lower():
+                        raise RuntimeError(f"typst watch: compile failed:\n{new.strip()}")
+                    return
+            if not alive:
+                raise RuntimeError(f"typst watch exited:\n{new.strip()}")
+            time.sleep(0.05)
+        raise TimeoutError(f"typst watch: no compile within {timeout:.0f}s (see {self.log_file})")
+
+    def _inputs_newer_than_pdf(self, typst_content: str) -> bool:
+        """True when an image main.typ uses changed after the PDF was written (ctime catches relinks)."""
+        try:
+            built = self.out_pdf.stat().st_mtime
+        except OSError:
+            return True
+        for ref in set(TYPST_IMAGE_RE.findall(typst_content)):
+            try:
+                st = (self.project_dir / ref).stat()
+            except OSError:
+                continue
+            if max(st.st_mtime, st.st_ctime) > built:
+                return True
+        return False
+
+    def start(self):
+        self.stop()
+        log = open(self.log_file, "w", encoding="utf-8")  # fresh log per watcher
+        proc = subprocess.Popen(
+            ["typst", "watch", "--root", str(self.project_dir), str(self.main), str(self.out_pdf)],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True,  # survive the CLI exiting
+        )
+        log.close()
+        self._procs[proc.pid] = proc
+        self.state_file.write_text(json.dumps({"pid": proc.pid, "out_pdf": str(self.out_pdf),
+                                               "identity": _process_identity(proc.pid)}))
+        self._wait_for_compile(0)
+
+    def stop(self) -> bool:
+        """Terminate this project's watcher (whatever PDF it writes). True if one was running."""
+        state = self._live_state()
+        if state:
+            os.kill(state["pid"], signal.SIGTERM)
+            proc = self._procs.pop(state["pid"], None)
+            if proc is not None:
+                proc.wait()
+        self.state_file.unlink(missing_ok=True)
+        return state is not None
+
+    def compile(self, typst_content: str):
+        offset = self._log_size()
+        changed = write_if_changed(self.main, typst_content)
+        if self.pid() is None:
+            self.start()  # first compile happens on startup
+        elif changed or self._inputs_newer_than_pdf(typst_content):
+            if not changed:
+                self.main.touch()  # only images changed: make sure the watcher recompiles now
+            self._wait_for_compile(offset)
+
+
+def compile_typst(typst_content: str, out_pdf: Path, watch: bool = False, images_dir: Path = IMAGES_DIR):
+    """
+    Write main.typ into a stable project dir next to the PDF and compile it.
+    watch=True drives a persistent `typst watch` process (see TypstWatch)
+    instead of cold-starting `typst compile`.
+    """
+    project_dir = out_pdf.parent / "typst_project"
+    project_dir.mkdir(parents=True, exist_ok=True)
+    _link_images_dir(project_dir, images_dir)
+    if watch:
+        with concurrency_slot("compile"), \
+             PROFILER.span("typst watch", "compile", bytes_in=len(typst_content.encode("utf-8"))) as span:
+            TypstWatch(project_dir, out_pdf).compile(typst_content)
+            span["bytes_out"] = _file_size(out_pdf)
+    else:
+        write_if_changed(project_dir / "main.typ", typst_content)
+        _run_compiler("typst", ["typst", "compile", "--root", str(project_dir), str(project_dir / "main.typ"), str(out_pdf)],
+                      len(typst_content.encode("utf-8")), out_pdf)
     print(f"  ✓ PDF: {out_pdf}")
 
 
-def compile_quarto(file_blocks: dict[str, str], out_dir: Path):
-    """Write Quarto project files and render."""
+def _link_image(src: Path, dest_dir: Path) -> bool:
+    """
+    Make src available as dest_dir/src.name without copying bytes: hardlink,
+    else symlink, else copy. Returns False if it was already linked.
+    """
+    dest = dest_dir / src.name
+    if dest.exists() and os.path.samefile(src, dest):
+        return False
+    _link_file(src, dest)
+    return True
+
+
+def _enable_quarto_freeze(quarto_yml: str) -> str:
+    """Turn on execute freeze/cache in _quarto.yml unless the project already sets them."""
+    try:
+        config = yaml.safe_load(quarto_yml) or {}
+    except yaml.YAMLError:
+        return quarto_yml  # let quarto report the syntax error
+    if not isinstance(config, dict):
+        return quarto_yml
+    execute = config.setdefault("execute", {}) or {}
+    if "freeze" in execute and "cache" in execute:
+        return quarto_yml
+    execute.setdefault("freeze", "auto")   # only re-execute chapters whose source changed
+    execute.setdefault("cache", True)      # knitr/jupyter cell cache
+    config["execute"] = execute
+    return yaml.dump(config, allow_unicode=True, sort_keys=False)
+
+
+def write_quarto_project(file_blocks: dict[str, str], out_dir: Path) -> list[str]:
+    """
+    Write Quarto project files (render separately with render_quarto).
+    Unchanged files are left untouched so their mtimes survive; returns the
+    names that were actually written.
+    """
     out_dir.mkdir(parents=True, exist_ok=True)
+    changed = []
     for filename, content in file_blocks.items():
-        (out_dir / filename).write_text(content, encoding="utf-8")
-    orig = os.getcwd()
-    try:
-        os.chdir(out_dir)
-        subprocess.run(["quarto", "render"], check=True)
-    finally:
-        os.chdir(orig)
+        if filename == "_quarto.yml":
+            content = _enable_quarto_freeze(content)
+        if write_if_changed(out_dir / filename, content):
+            changed.append(filename)
+    return changed
+
+
+QUARTO_RENDER_STAMP = ".render_stamp"
+
+
+def _quarto_fingerprint(out_dir: Path) -> str:
+    """Hash of every project input (path, size, mtime), ignoring Quarto's own output/cache dirs."""
+    h = hashlib.sha256()
+    for f in sorted(out_dir.rglob("*")):
+        rel = f.relative_to(out_dir)
+        if rel.parts[0].startswith((".", "_book", "_freeze")) or not f.is_file():
+            continue
+        st = f.stat()
+        h.update(f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def quarto_outputs(out_dir: Path) -> list[Path]:
+    """PDF/EPUB files a render left in the project (normally under _book/), ignoring images."""
+    return sorted(p for p in out_dir.rglob("*") if p.suffix in {".pdf", ".epub"} and "images" not in p.parts)
+
+
+def render_quarto(out_dir: Path, force: bool = False):
+    """
+    Run `quarto render` in an already-written project directory. Skipped when
+    no project file or image changed since the last successful render.
+    """
+    stamp = out_dir / QUARTO_RENDER_STAMP
+    fingerprint = _quarto_fingerprint(out_dir)
+    rendered = any(p.suffix == ".pdf" for p in quarto_outputs(out_dir))
+    if not force and rendered and stamp.exists() and stamp.read_text() == fingerprint:
+        print(f"  ✓ Quarto output unchanged, skipping render: {out_dir}")
+        return
+    # cwd= rather than os.chdir: other pipeline stages run concurrently in this process
+    source_bytes = sum(_file_size(f) for f in out_dir.glob("*.qmd"))
+    _run_compiler("quarto", ["quarto", "render"], source_bytes, out_dir / "_book", cwd=out_dir)
+    stamp.write_text(fingerprint)
     print(f"  ✓ Quarto output: {out_dir}")
 
 
-def compile_weasyprint(html: str, css: str, out_pdf: Path):
-    """Write HTML/CSS and render to PDF with WeasyPrint."""
+def compile_quarto(file_blocks: dict[str, str], out_dir: Path):
+    """Write Quarto project files and render."""
+    write_quarto_project(file_blocks, out_dir)
+    render_quarto(out_dir)
+
+
+WEASYPRINT_BLEED_CSS = "@page { bleed: 0.125in; }"
+
+# Per-process WeasyPrint state: font discovery and stylesheet parsing are the
+# expensive part of a render, so keep them for the life of the process (and of
+# each worker process when rendering parts in parallel).
+_WEASY_LOCK = threading.Lock()
+_WEASY_FONTS = None
+_WEASY_CSS: dict[tuple[str, str], object] = {}
+
+
+def _weasy_stylesheet(css: str, base_url: str):
+    """
+    Parsed weasyprint.CSS for css, shared across renders in this process.
+    base_url resolves relative url(images/...) references, as for the HTML.
+    """
+    global _WEASY_FONTS
+    from weasyprint import CSS
+    try:
+        from weasyprint.text.fonts import FontConfiguration
+    except ImportError:  # weasyprint < 53
+        from weasyprint.fonts import FontConfiguration
+    key = (_sha(css), base_url)
+    with _WEASY_LOCK:
+        if _WEASY_FONTS is None:
+            _WEASY_FONTS = FontConfiguration()
+        if key not in _WEASY_CSS:
+            _WEASY_CSS[key] = CSS(string=css, base_url=base_url, font_config=_WEASY_FONTS)
+        return _WEASY_CSS[key]
+
+
+def _weasyprint_render(html: str, css: str, base_url: str) -> bytes:
+    """Render one HTML document to PDF bytes with the library API."""
+    from weasyprint import HTML
+    stylesheets = [_weasy_stylesheet(css, base_url), _weasy_stylesheet(WEASYPRINT_BLEED_CSS, base_url)]
+    # The stylesheet is passed pre-parsed, not fetched through the shell's <link>
+    html = re.sub(r"""<link[^>]*href=["']style\.css["'][^>]*>""", "", html)
+    return HTML(string=html, base_url=base_url).write_pdf(stylesheets=stylesheets, font_config=_WEASY_FONTS)
+
+
+def split_html_parts(html: str, parts: int) -> list[str]:
+    """
+    Split a book document into up to `parts` standalone documents at top-level
+    <section> boundaries, each with the original head. Sections are grouped
+    contiguously and balanced by size.
+    """
+    m = re.search(r"<body[^>]*>(.*)</body>", html, re.S | re.I)
+    if parts < 2 or not m:
+        return [html]
+    body = m.group(1)
+    starts = [s.start() for s in re.finditer(r"<section\b", body, re.I)]
+    if len(starts) < 2:
+        return [html]
+    starts[0] = 0  # anything before the first section rides with it
+    sections = [body[a:b] for a, b in zip(starts, starts[1:] + [len(body)])]
+    target = len(body) / min(parts, len(sections))
+    groups, current, size = [], [], 0
+    for section in sections:
+        if current and size + len(section) / 2 > target and len(groups) < parts - 1:
+            groups.append(current)
+            current, size = [], 0
+        current.append(section)
+        size += len(section)
+    groups.append(current)
+    head, tail = html[:m.start(1)], html[m.end(1):]
+    return [head + "".join(g) + tail for g in groups]
+
+
+def _merge_pdfs(pdfs: list[bytes], out_pdf: Path):
+    import io
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    for pdf in pdfs:
+        writer.append(io.BytesIO(pdf))
+    with open(out_pdf, "wb") as f:
+        writer.write(f)
+
+
+def compile_weasyprint(html: str, css: str, out_pdf: Path, parts: int = 1, images_dir: Path = IMAGES_DIR):
+    """
+    Render HTML/CSS to PDF with WeasyPrint in-process, reusing fonts and parsed
+    CSS across renders. With parts > 1, chapter groups render in parallel
+    worker processes and are merged with pypdf (page counters restart in each
+    part). Falls back to the weasyprint CLI if the library is not importable.
+    """
+    try:
+        import weasyprint  # noqa: F401
+    except ImportError:
+        return _compile_weasyprint_cli(html, css, out_pdf, images_dir)
+    if parts > 1:
+        try:
+            import pypdf  # noqa: F401
+        except ImportError:
+            print("  ⚠️  pypdf not installed — rendering WeasyPrint output in one pass")
+            parts = 1
+    documents = split_html_parts(html, parts)
+    base_url = str(images_dir.resolve().parent) + os.sep
+    bytes_in = len(html.encode("utf-8")) + len(css.encode("utf-8"))
+    with concurrency_slot("compile"), \
+         PROFILER.span("weasyprint", cat="compile", bytes_in=bytes_in, parts=len(documents)) as span:
+        if len(documents) == 1:
+            cpu0 = time.process_time()
+            out_pdf.write_bytes(_weasyprint_render(html, css, base_url))
+            span["cpu_s"] = time.process_time() - cpu0
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=len(documents)) as pool:
+                pdfs = list(pool.map(_weasyprint_render, documents, [css] * len(documents),
+                                     [base_url] * len(documents)))
+            _merge_pdfs(pdfs, out_pdf)
+        span["bytes_out"] = _file_size(out_pdf)
+    print(f"  ✓ PDF: {out_pdf}" + (f" ({len(documents)} parts)" if len(documents) > 1 else ""))
+
+
+def _compile_weasyprint_cli(html: str, css: str, out_pdf: Path, images_dir: Path = IMAGES_DIR):
+    """Write HTML/CSS and render to PDF with the WeasyPrint CLI."""
     with tempfile.TemporaryDirectory() as tmp:
         tmp_dir = Path(tmp)
         # Copy images symlink
-        if IMAGES_DIR.exists():
+        if images_dir.exists():
             img_link = tmp_dir / "images"
-            img_link.symlink_to(IMAGES_DIR.resolve())
+            img_link.symlink_to(images_dir.resolve())
         (tmp_dir / "book.html").write_text(html, encoding="utf-8")
         (tmp_dir / "style.css").write_text(css, encoding="utf-8")
-        subprocess.run([
+        _run_compiler("weasyprint", [
             "weasyprint",
             str(tmp_dir / "book.html"),
             str(out_pdf),
             "--pdf-bleed", "0.125in",
-        ], check=True)
+        ], len(html.encode("utf-8")) + len(css.encode("utf-8")), out_pdf)
     print(f"  ✓ PDF: {out_pdf}")
 
 
@@ -418,8 +2926,14 @@ def compile_weasyprint(html: str, css: str, out_pdf: Path):
 # EPUB EXPORT (via Pandoc)
 # ─────────────────────────────────────────────
 
-def export_epub(manuscript_md: str, meta: dict, out_epub: Path):
-    """Convert Markdown manuscript to EPUB via Pandoc."""
+def export_epub(manuscript_md: str, meta: dict, out_epub: Path, images: Optional[dict[str, Path]] = None,
+                images_dir: Path = IMAGES_DIR):
+    """
+    Convert Markdown manuscript to EPUB via Pandoc. With images ({marker
+    filename: path}), [IMAGE: ...] markers become embedded images.
+    """
+    if images is not None:
+        manuscript_md = embed_image_markers(manuscript_md, images, images_dir)
     with tempfile.NamedTemporaryFile(suffix=".md", delete=False, mode="w") as f:
         f.write(manuscript_md)
         tmp = Path(f.name)
@@ -431,7 +2945,7 @@ def export_epub(manuscript_md: str, meta: dict, out_epub: Path):
             "--metadata", f"author={meta.get('author', 'Unknown')}",
             "--toc",
         ]
-        subprocess.run(cmd, check=True)
+        _run_compiler("pandoc", cmd, len(manuscript_md.encode("utf-8")), out_epub, cat="epub")
         print(f"  ✓ EPUB: {out_epub}")
     finally:
         tmp.unlink(missing_ok=True)
@@ -447,51 +2961,388 @@ def build_book(
     output_dir: Path = OUTPUT_DIR,
     override_engine: Optional[str] = None,
     save_sources: bool = False,
+    image_workers: Optional[int] = None,
+    regen_images: bool = False,
+    incremental: bool = True,
+    llm_workers: int = 4,
+    chunk_tokens: int = FORMAT_CHUNK_TOKENS,
+    trace: bool = False,
+    typst_watch: bool = False,
+    weasyprint_parts: int = 1,
+    images_dir: Path = IMAGES_DIR,
+    report: bool = True,
+    epub_image_format: str = "jpeg",
+    formatter: Optional[str] = None,
 ):
-    """Full pipeline: format → generate images → compile → EPUB."""
+    """
+    Full pipeline: format → generate images → renditions → compile, with EPUB
+    alongside. The EPUB job starts in the background and exports as soon as the
+    EPUB renditions exist. Formatting output is streamed: images start as soon as an `images`
+    block closes, and Quarto project files are written (and finished images
+    copied in) while the rest of the response and the images are still coming.
+    incremental: format per chapter and reuse unchanged chapters from the
+    output dir's build state; False sends the whole manuscript in one call.
+    Chunks of up to chunk_tokens are formatted llm_workers at a time.
+    Writes profile.json (every LLM call, image, compiler run) and, with
+    trace=True, a Chrome trace showing how the stages overlap.
+    typst_watch: compile through a persistent `typst watch` process.
+    weasyprint_parts: render WeasyPrint chapter groups in that many processes.
+    images_dir: where this book's images live (batch mode gives each book its own).
+    report: print the cache/profile summary and write profile.json (batch mode
+    reports once for the whole batch instead).
+    Returns the output files written (PDF, EPUB; for Quarto, what the render produced).
+    epub_image_format: "jpeg" or "webp" for the EPUB renditions (see make_renditions).
+    formatter: auto | native | hybrid | llm (default: meta["formatter"], else auto).
+    native converts Markdown → Typst / a Quarto project without an LLM, hybrid
+    adds an LLM-written preamble; auto means native for both. WeasyPrint
+    always uses the LLM.
+    """
     output_dir.mkdir(parents=True, exist_ok=True)
     title_slug = meta.get("title", "book").replace(" ", "_").lower()[:40]
 
     engine = override_engine or decide_engine(meta)
+    formatter = formatter or meta.get("formatter") or "auto"
+    if formatter not in FORMATTERS:
+        raise ValueError(f"unknown formatter {formatter!r} (expected one of {', '.join(FORMATTERS)})")
+    if formatter == "auto" or engine == "weasyprint":
+        formatter = "llm" if engine == "weasyprint" else "native"
     print(f"\n📚 Building: {meta.get('title', 'Untitled')}")
-    print(f"   Engine: {engine} | Book type: {meta.get('book_type', 'auto')}")
+    print(f"   Engine: {engine} | Formatter: {formatter} | Book type: {meta.get('book_type', 'auto')}")
 
     image_list = []
+    outputs    = []
     out_pdf    = output_dir / f"{title_slug}.pdf"
     out_epub   = output_dir / f"{title_slug}.epub"
-
-    if engine == "typst":
-        typst_src, image_list = format_for_typst(meta, manuscript)
-        if image_list:
-            batch_generate_images(image_list, meta.get("book_type", "text_heavy"))
-        compile_typst(typst_src, out_pdf)
-
-    elif engine == "quarto":
-        quarto_dir = output_dir / "quarto_project"
-        file_blocks, image_list = format_for_quarto(meta, manuscript)
-        if image_list:
-            batch_generate_images(image_list, meta.get("book_type", "scientific"))
-        # Copy images into project
-        if IMAGES_DIR.exists():
-            (quarto_dir / "images").mkdir(parents=True, exist_ok=True)
-            for img in IMAGES_DIR.glob("*.png"):
-                import shutil
-                shutil.copy(img, quarto_dir / "images" / img.name)
-        compile_quarto(file_blocks, quarto_dir)
-
-    elif engine == "weasyprint":
-        html, css, image_list = format_for_weasyprint(meta, manuscript)
-        if image_list:
-            batch_generate_images(image_list, meta.get("book_type", "kids"))
-        compile_weasyprint(html, css, out_pdf)
+    quarto_dir = output_dir / "quarto_project"
+    book_type  = meta.get("book_type", {"typst": "text_heavy", "quarto": "scientific"}.get(engine, "kids"))
+    profiler   = PROFILER
+    state      = BuildState(output_dir / BUILD_STATE_FILE) if incremental else None
+
+    # Each image is encoded into its renditions (cached by source hash) as soon as it is
+    # ready, while the rest generate; Quarto also gets it copied into the project.
+    renditioner = ThreadPoolExecutor(max_workers=1)
+    pre_encoded = []
+
+    def on_image(path: Path):
+        if engine == "quarto":
+            _link_image(path, quarto_dir / "images")
+        pre_encoded.append(renditioner.submit(make_renditions, [path], images_dir, meta.get("trim_size", "6x9"),
+                                              epub_image_format, 1, True))
+
+    images = {"queue": None, "token": None}
+    images_lock = threading.Lock()
+
+    def start_images(image_list: list[dict]):
+        """Queue images without blocking; safe to call repeatedly as lists arrive."""
+        if not image_list:
+            return
+        with images_lock:
+            if images["queue"] is None:
+                images["token"] = profiler.begin("images")
+                images["queue"] = queue_images(image_list, book_type, image_workers, regen_images, on_image,
+                                               images_dir=images_dir)
+            else:
+                queue_images(image_list, book_type, image_workers, regen_images, queue=images["queue"],
+                             images_dir=images_dir)
+
+    def finish_images() -> list[Path]:
+        if images["queue"] is None:
+            return []
+        try:
+            return images["queue"].join()
+        finally:
+            profiler.end(images["token"])
+
+    def finish_renditions(image_list: list[dict]) -> dict[str, Path]:
+        """
+        Wait for images, make print/EPUB renditions and release the EPUB job;
+        returns print renditions. Most images were already encoded as they
+        arrived, so this mostly links cached renditions.
+        """
+        paths = finish_images()
+        wait(pre_encoded)   # errors resurface in the full pass below
+        with profiler.stage("renditions"):
+            renditions = make_renditions(paths, images_dir, meta.get("trim_size", "6x9"), epub_image_format) \
+                if paths else {}
+        epub_renditions = renditions.get("epub") or {p.stem: p for p in paths}
+        epub_images.set_result(marker_renditions(manuscript, image_list, epub_renditions))
+        return renditions.get("print", {})
+
+    def on_block(label: str, content: str):
+        """
+        Streamed code block: start its images now; write Quarto files as they
+        arrive. Files that reference images wait for the renditions, so each is
+        written once, already rewritten, and keeps its mtime across no-op builds.
+        """
+        if label == "images":
+            try:
+                start_images(json.loads(content))
+            except (json.JSONDecodeError, TypeError, KeyError):
+                pass  # the full response is re-parsed after formatting
+        elif engine == "quarto" and "." in label and not IMAGE_REF_RE.search(content):
+            write_quarto_project({label: content}, quarto_dir)
 
     # EPUB export (via Pandoc, works for all engines from Markdown)
     formats = meta.get("output_formats", ["pdf"])
+    background = ThreadPoolExecutor(max_workers=1)
+    epub_job = None
+    epub_images = Future()   # {marker filename: path}, set once renditions are done
     if "epub" in formats:
-        export_epub(manuscript, meta, out_epub)
+        def run_epub():
+            embedded = epub_images.result()
+            with profiler.stage("epub"):
+                export_epub(manuscript, meta, out_epub, embedded, images_dir)
+        epub_job = background.submit(run_epub)
+
+    try:
+        if engine == "typst":
+            with profiler.stage("format"):
+                if formatter == "llm":
+                    typst_src, image_list = format_for_typst(meta, manuscript, state, on_block, llm_workers,
+                                                             chunk_tokens)
+                else:
+                    typst_src, image_list = format_typst_native(meta, manuscript, styled=formatter == "hybrid")
+            start_images(image_list)
+            renditions = finish_renditions(image_list)
+            with profiler.stage("compile"):
+                typst_src = rewrite_image_refs(typst_src, renditions, images_dir)
+                compile_typst(typst_src, out_pdf, watch=typst_watch, images_dir=images_dir)
+            outputs.append(out_pdf)
+
+        elif engine == "quarto":
+            with profiler.stage("format"):
+                if formatter == "llm":
+                    file_blocks, image_list = format_for_quarto(meta, manuscript, state, on_block, llm_workers,
+                                                                chunk_tokens)
+                else:
+                    file_blocks, image_list = format_quarto_native(meta, manuscript, styled=formatter == "hybrid")
+            start_images(image_list)
+            with profiler.stage("write project"):   # files without images need not wait for them
+                write_quarto_project({name: text for name, text in file_blocks.items()
+                                      if not IMAGE_REF_RE.search(text)}, quarto_dir)
+            renditions = finish_renditions(image_list)
+            if images_dir.exists():
+                for img in images_dir.glob("*.png"):
+                    if not (quarto_dir / "images" / img.name).exists():
+                        _link_image(img, quarto_dir / "images")
+            for path in renditions.values():
+                _link_image(path, quarto_dir / "images" / path.parent.name)
+            with profiler.stage("write project"):
+                write_quarto_project({name: rewrite_image_refs(text, renditions, images_dir)
+                                      for name, text in file_blocks.items()
+                                      if IMAGE_REF_RE.search(text)}, quarto_dir)
+            with profiler.stage("compile"):
+                render_quarto(quarto_dir)
+            outputs += quarto_outputs(quarto_dir)
+
+        elif engine == "weasyprint":
+            with profiler.stage("format"):
+                html, css, image_list = format_for_weasyprint(meta, manuscript, state, on_block, llm_workers, chunk_tokens)
+            start_images(image_list)
+            renditions = finish_renditions(image_list)
+            with profiler.stage("compile"):
+                html = rewrite_image_refs(html, renditions, images_dir)
+                compile_weasyprint(html, css, out_pdf, parts=weasyprint_parts, images_dir=images_dir)
+            outputs.append(out_pdf)
+
+        if epub_job:
+            epub_job.result()
+            outputs.append(out_epub)
+    except BaseException:
+        if images["queue"] is not None:
+            images["queue"].abort()
+        raise
+    finally:
+        epub_images.cancel()  # no-op once set; otherwise unblocks the EPUB job so shutdown cannot hang
+        background.shutdown(wait=True, cancel_futures=True)
+        renditioner.shutdown(wait=True, cancel_futures=True)
 
     print(f"\n✅ Done! Output: {output_dir}")
-    return output_dir
+    if not report:
+        return outputs
+    print(f"   {LLM_CACHE.summary()}")
+    print(f"   {LLM_DISPATCHER.summary()}")
+    print(llm_tier_report(PROFILER.spans))
+    print(profiler.report())
+    profiler.write_json(output_dir / "profile.json")
+    print(f"   Profile: {output_dir / 'profile.json'}")
+    if trace:
+        profiler.write_chrome_trace(output_dir / "trace.json")
+        print(f"   Trace:   {output_dir / 'trace.json'} (open in chrome://tracing or ui.perfetto.dev)")
+    return outputs
+
+
+# ─────────────────────────────────────────────
+# BATCH MODE (many books, one scheduler)
+# ─────────────────────────────────────────────
+
+BATCH_STATUS_FILE = "batch_status.json"
+BATCH_SPEC_KEYS   = {"id", "content"}   # batch-only keys, stripped from the book metadata
+
+
+def load_batch_specs(source: Path) -> list[dict]:
+    """
+    Book specs from a directory of *.yaml / *.yml files or a JSONL file (one
+    spec per line). A spec is book.yaml metadata plus optional batch keys:
+      id       output subdirectory (default: file stem, or title slug in JSONL)
+      content  manuscript path, relative to the spec (default: a sibling
+               <stem>.md if present, else generated from `subject`)
+    """
+    specs = []
+    if source.is_dir():
+        for path in sorted([*source.glob("*.yaml"), *source.glob("*.yml")]):
+            spec = yaml.safe_load(path.read_text()) or {}
+            spec.setdefault("id", path.stem)
+            if "content" in spec:
+                spec["content"] = str(path.parent / spec["content"])
+            elif path.with_suffix(".md").exists():
+                spec["content"] = str(path.with_suffix(".md"))
+            specs.append(spec)
+    else:
+        for n, line in enumerate(source.read_text().splitlines(), 1):
+            if not line.strip():
+                continue
+            spec = json.loads(line)
+            spec.setdefault("id", str(spec.get("title") or f"book-{n}").replace(" ", "_").lower()[:40])
+            if "content" in spec:
+                spec["content"] = str(source.parent / spec["content"])
+            specs.append(spec)
+    seen = set()
+    for spec in specs:
+        spec["id"] = str(spec["id"])
+        if spec["id"] in seen:
+            raise ValueError(f"Duplicate book id in {source}: {spec['id']!r} (set `id` explicitly)")
+        seen.add(spec["id"])
+    return specs
+
+
+def _spec_hash(spec: dict) -> str:
+    """Hash of a spec and its manuscript, so edited books rebuild on resume."""
+    try:
+        manuscript = Path(spec["content"]).read_text(encoding="utf-8") if spec.get("content") else ""
+    except OSError:
+        manuscript = ""  # reported as this book's failure when it runs
+    return _sha(json.dumps(spec, sort_keys=True, default=str) + "\0" + manuscript)
+
+
+class BatchStatus:
+    """
+    batch_status.json in the batch output dir: one entry per book id with its
+    state (pending | running | done | failed), spec hash, timings, outputs and
+    last error. Rewritten atomically on every change, so after a crash a
+    re-run skips books that are done and retries the rest.
+    """
+
+    def __init__(self, path: Path):
+        self.path  = path
+        self._lock = threading.Lock()
+        try:
+            self.books = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            self.books = {}
+
+    def get(self, book_id: str) -> dict:
+        with self._lock:
+            return dict(self.books.get(book_id, {}))
+
+    def update(self, book_id: str, **fields):
+        with self._lock:
+            self.books.setdefault(book_id, {}).update(fields)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.books, indent=1, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.path)
+
+
+def _batch_manuscript(spec: dict, meta: dict, book_dir: Path, resumed: bool,
+                      sharded: bool, llm_workers: int) -> str:
+    """The spec's manuscript; generated (or, when resuming the same spec, reloaded) if it has none."""
+    if spec.get("content"):
+        return Path(spec["content"]).read_text(encoding="utf-8")
+    md_out = book_dir / "manuscript.md"
+    if resumed and md_out.exists():
+        print(f"📝 Reusing manuscript: {md_out}")
+        return md_out.read_text(encoding="utf-8")
+    book_dir.mkdir(parents=True, exist_ok=True)
+    (book_dir / "book.yaml").write_text(yaml.dump(meta, allow_unicode=True))
+    manuscript = generate_manuscript(meta, sharded=sharded, workers=llm_workers)
+    md_out.write_text(manuscript, encoding="utf-8")
+    print(f"📝 Manuscript saved: {md_out}")
+    return manuscript
+
+
+def run_batch(
+    source: Path,
+    output_dir: Path = OUTPUT_DIR,
+    jobs: int = 2,
+    restart: bool = False,
+    sharded: bool = False,
+    trace: bool = False,
+    **build_kwargs,
+) -> dict[str, dict]:
+    """
+    Build every book in `source` (see load_batch_specs), `jobs` books at a time,
+    each into output_dir/<id>/ with its own images dir. Global LLM / mflux /
+    compiler caps come from set_concurrency_limits; the LLM cache and the
+    shared image store are common to all books. Books already done with an
+    unchanged spec are skipped unless restart. Writes one batch-wide
+    profile.json (and trace.json with trace). Returns the status entries.
+    """
+    specs  = load_batch_specs(source)
+    status = BatchStatus(output_dir / BATCH_STATUS_FILE)
+    llm_workers = build_kwargs.get("llm_workers", 4)
+
+    todo = []
+    for spec in specs:
+        digest = _spec_hash(spec)
+        entry  = status.get(spec["id"])
+        if not restart and entry.get("state") == "done" and entry.get("spec_hash") == digest:
+            continue
+        todo.append((spec, digest, entry.get("spec_hash") == digest))
+        status.update(spec["id"], state="pending", spec_hash=digest)
+    print(f"\n📦 Batch: {len(specs)} book(s) in {source}, {len(specs) - len(todo)} already done, "
+          f"building {len(todo)}, {jobs} at a time")
+
+    def run(spec: dict, digest: str, resumed: bool):
+        book_id  = spec["id"]
+        book_dir = output_dir / book_id
+        meta     = {k: v for k, v in spec.items() if k not in BATCH_SPEC_KEYS}
+        status.update(book_id, state="running", started=time.time(), finished=None, error=None)
+        try:
+            with PROFILER.span(book_id, "book"):
+                manuscript = _batch_manuscript(spec, meta, book_dir, resumed, sharded, llm_workers)
+                outputs = build_book(meta, manuscript, book_dir, images_dir=book_dir / "images", report=False,
+                                     **build_kwargs)
+        except Exception as e:
+            status.update(book_id, state="failed", finished=time.time(), error=f"{type(e).__name__}: {e}")
+            print(f"  ✗ {book_id} failed: {e}")
+            return
+        status.update(book_id, state="done", finished=time.time(),
+                      outputs=[p.relative_to(book_dir).as_posix() for p in outputs])
+
+    pool = ThreadPoolExecutor(max_workers=max(1, jobs))
+    try:
+        for fut in [pool.submit(run, *job) for job in todo]:
+            fut.result()
+    finally:
+        # Ctrl-C: queued books stay "pending", running ones "running"; both are retried next run
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    books  = {spec["id"]: status.get(spec["id"]) for spec in specs}
+    failed = [b for b, e in books.items() if e.get("state") == "failed"]
+    print(f"\n📦 Batch done: {len(books) - len(failed)}/{len(books)} book(s) built"
+          + (f", failed: {', '.join(failed)}" if failed else ""))
+    print(f"   Status:  {status.path}")
+    print(f"   {LLM_CACHE.summary()}")
+    print(f"   {LLM_DISPATCHER.summary()}")
+    print(llm_tier_report(PROFILER.spans))
+    print(PROFILER.report())
+    PROFILER.write_json(output_dir / "profile.json")
+    print(f"   Profile: {output_dir / 'profile.json'}")
+    if trace:
+        PROFILER.write_chrome_trace(output_dir / "trace.json")
+        print(f"   Trace:   {output_dir / 'trace.json'}")
+    return books
 
 
 # ─────────────────────────────────────────────
@@ -581,11 +3432,107 @@ def main():
     p.add_argument("--save-sources",  action="store_true",
                    help="Archive source materials reviewed during generation")
     p.add_argument("--output",        default="output", help="Output directory")
+    p.add_argument("--llm-backend",   default="anthropic", choices=sorted(LLM_BACKENDS),
+                   help="LLM backend (default: anthropic; ollama uses OLLAMA_HOST)")
     p.add_argument("--llm-model",     default="qwen2.5:7b",
-                   help="Ollama model for content generation (default: qwen2.5:7b)")
+                   help="Ollama model for content generation with --llm-backend ollama (default: qwen2.5:7b)")
+    p.add_argument("--llm-rpm",       type=int, default=None,
+                   help="Client-side limit on LLM requests per minute (default: none)")
+    p.add_argument("--llm-tpm",       type=int, default=None,
+                   help="Client-side limit on LLM tokens per minute, prompt + response (default: none)")
+    p.add_argument("--llm-retries",   type=int, default=6,
+                   help="Retries per LLM request on 429/5xx/overloaded/connection errors (default: 6)")
+    p.add_argument("--shard-chapters", action="store_true",
+                   help="Generate the manuscript chapter-by-chapter from an outline, in parallel")
+    p.add_argument("--llm-concurrency", type=int, default=4,
+                   help="Max concurrent LLM requests for sharded generation and formatting (default: 4)")
+    p.add_argument("--image-workers", type=int, default=None,
+                   help="Concurrent mflux processes (default: sized from CPU count and memory)")
+    p.add_argument("--regen-images", action="store_true",
+                   help="Regenerate every image even if its prompt and settings are unchanged")
+    p.add_argument("--no-incremental", action="store_true",
+                   help="Format the whole manuscript in one LLM call, ignoring the per-chapter build state")
+    p.add_argument("--chunk-tokens", type=int, default=FORMAT_CHUNK_TOKENS,
+                   help=f"Manuscript tokens per formatting call (default: {FORMAT_CHUNK_TOKENS})")
+    p.add_argument("--formatter",     default=None, choices=FORMATTERS,
+                   help="Typst/Quarto formatting: native (no LLM), hybrid (native body + LLM preamble), llm, "
+                        "or auto = native (default: book.yaml `formatter`, else auto)")
+    p.add_argument("--epub-images",   default="jpeg", choices=sorted(EPUB_IMAGE_FORMATS),
+                   help="Image format for EPUB renditions (default: jpeg; webp is smaller but needs EPUB 3.3 readers)")
+    p.add_argument("--trace",         action="store_true",
+                   help="Also write a Chrome trace (trace.json) of build stage overlap")
+    p.add_argument("--typst-watch",   action="store_true",
+                   help="Compile Typst via a background `typst watch` kept warm across builds")
+    p.add_argument("--stop-typst-watch", action="store_true",
+                   help="Stop the background typst watcher for --output and exit")
+    p.add_argument("--weasyprint-parts", type=int, default=1, metavar="N",
+                   help="Render WeasyPrint output as N chapter groups in parallel and merge (needs pypdf; "
+                        "page numbers restart per part)")
+    p.add_argument("--batch",         metavar="DIR|JSONL",
+                   help="Build every book spec in a directory of YAML files or a JSONL file into --output/<id>/")
+    p.add_argument("--batch-jobs",    type=int, default=2,
+                   help="Books built at once in --batch mode (default: 2)")
+    p.add_argument("--batch-restart", action="store_true",
+                   help="Rebuild every book instead of resuming from batch_status.json")
+    p.add_argument("--max-llm-calls", type=int, default=None,
+                   help="Process-wide cap on concurrent LLM requests, lowered automatically while "
+                        "throttled (default: --llm-concurrency)")
+    p.add_argument("--max-mflux",     type=int, default=None,
+                   help="Batch-wide cap on concurrent mflux processes (default: sized from CPU count and memory)")
+    p.add_argument("--max-compilers", type=int, default=None,
+                   help="Batch-wide cap on concurrent typst/quarto/weasyprint/pandoc runs (default: CPUs / 2)")
+    cache = p.add_mutually_exclusive_group()
+    cache.add_argument("--no-cache",      action="store_true",
+                       help="Bypass the LLM response cache entirely")
+    cache.add_argument("--refresh-cache", action="store_true",
+                       help="Ignore cached LLM responses but store fresh ones")
 
     args = p.parse_args()
     output_dir = Path(args.output)
+    if args.stop_typst_watch:
+        stopped = TypstWatch(output_dir / "typst_project", output_dir).stop()
+        print("🛑 typst watch stopped" if stopped else "No typst watch running")
+        return
+    if args.llm_backend == "ollama":
+        set_llm_backend(OllamaBackend(model=args.llm_model))
+    set_llm_dispatcher(LLMDispatcher(
+        max_concurrency=args.max_llm_calls or args.llm_concurrency,
+        rpm=args.llm_rpm,
+        tpm=args.llm_tpm,
+        max_retries=args.llm_retries,
+    ))
+    if args.no_cache:
+        LLM_CACHE.mode = "off"
+    elif args.refresh_cache:
+        LLM_CACHE.mode = "refresh"
+
+    build_kwargs = dict(
+        override_engine=args.engine if args.engine != "auto" else None,
+        save_sources=args.save_sources,
+        image_workers=args.image_workers,
+        regen_images=args.regen_images,
+        incremental=not args.no_incremental,
+        llm_workers=args.llm_concurrency,
+        chunk_tokens=args.chunk_tokens,
+        typst_watch=args.typst_watch,
+        weasyprint_parts=args.weasyprint_parts,
+        epub_image_format=args.epub_images,
+        formatter=args.formatter,
+    )
+
+    # Path 0: batch of specs through one scheduler
+    if args.batch:
+        mflux = args.max_mflux or args.image_workers or default_image_workers("dev")
+        set_concurrency_limits(
+            mflux=mflux,
+            compile=args.max_compilers or max(1, (os.cpu_count() or 2) // 2),
+        )
+        build_kwargs["image_workers"] = mflux  # each book may use every free mflux slot
+        books = run_batch(Path(args.batch), output_dir, jobs=args.batch_jobs, restart=args.batch_restart,
+                          sharded=args.shard_chapters, trace=args.trace, **build_kwargs)
+        if any(entry.get("state") != "done" for entry in books.values()):
+            sys.exit(1)
+        return
 
     # Path 1: pre-existing YAML + manuscript
     if args.yaml and args.content:
@@ -602,14 +3549,14 @@ def main():
         print(f"📋 YAML saved: {yaml_out}")
 
         # Generate manuscript
-        manuscript = generate_manuscript(meta)
+        manuscript = generate_manuscript(meta, sharded=args.shard_chapters, workers=args.llm_concurrency)
         md_out = output_dir / "manuscript.md"
         md_out.write_text(manuscript, encoding="utf-8")
         print(f"📝 Manuscript saved: {md_out}")
 
     else:
         p.print_help()
-        print("\nError: provide either --yaml + --content, or --subject")
+        print("\nError: provide either --yaml + --content, --subject, or --batch")
         sys.exit(1)
 
     # Build
@@ -617,8 +3564,8 @@ def main():
         meta=meta,
         manuscript=manuscript,
         output_dir=output_dir,
-        override_engine=args.engine if args.engine != "auto" else None,
-        save_sources=args.save_sources,
+        trace=args.trace,
+        **build_kwargs,
     )
 
 
@@ -1,17 +1,32 @@
 #!/usr/bin/env python3
 """
 Convert DatologyAI wiki markdown files to HTML with navigation.
+Needs markdown_blocks.py (the shared line tokenizer) alongside this script.
+Builds are incremental: html/.build_cache.json records each page's source
+hash, title, wikilinks and inputs, and only pages whose inputs changed are
+rebuilt. --force rebuilds everything; --jobs N renders pages in N processes.
+Pages link one content-hashed stylesheet, html/assets/wiki.<hash>.css.
+The sidebar is rendered once; --shared-nav moves it to html/assets/nav.js.
 """
 
 import os
 import re
+import json
+import hashlib
+import argparse
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
+from markdown_blocks import tokenize
+
 # Paths
 WIKI_DIR = Path(__file__).parent
 CHAPTERS_DIR = WIKI_DIR / "chapters"
 OUTPUT_DIR = WIKI_DIR / "html"
+BUILD_CACHE_FILE = OUTPUT_DIR / ".build_cache.json"
+ASSETS_DIR = OUTPUT_DIR / "assets"
 
 # Chapter metadata
 CHAPTERS = [
@@ -252,14 +267,61 @@ body {
 }
 """
 
+SLUG_STRIP_RE = re.compile(r'[^a-z0-9\s-]')
+SLUG_SPACE_RE = re.compile(r'[\s_]+')
+WIKILINK_RE = re.compile(r'\[\[([^\]]+)\]\]')
+TITLE_RE = re.compile(r'^# (.+)$', re.MULTILINE)
+
 def slugify(text):
     """Convert text to URL-friendly slug."""
     text = text.lower()
-    text = re.sub(r'[^a-z0-9\s-]', '', text)
-    text = re.sub(r'[\s_]+', '-', text)
+    text = SLUG_STRIP_RE.sub('', text)
+    text = SLUG_SPACE_RE.sub('-', text)
     return text.strip('-')
 
-def convert_wikilinks(content, all_pages, base_path=""):
+class LinkResolver:
+    """
+    Wikilink target → page path, built once per run over all_pages.
+    A target resolves to the first page (in wiki order) whose file slug
+    contains slugify(target) or whose slugified title equals it — the
+    same rule as a linear scan, answered from a title-slug map and one
+    str.find over the joined file slugs. Results are memoized; lookups
+    that name a source page record unresolved targets against it.
+    """
+
+    def __init__(self, all_pages):
+        self.paths = [path for _, _, path in all_pages]
+        self.by_title = {}
+        for i, (_, title, _) in enumerate(all_pages):
+            self.by_title.setdefault(slugify(title), i)
+        # '\0' never occurs in a slug, so a match cannot straddle two pages
+        self.joined = '\0'.join(slug for slug, _, _ in all_pages)
+        self.starts = []
+        offset = 0
+        for slug, _, _ in all_pages:
+            self.starts.append(offset)
+            offset += len(slug) + 1
+        self.cache = {}    # slug → path
+        self.targets = {}  # target → path (skips slugify on repeats)
+        self.unresolved = {}   # target → [source pages]
+
+    def resolve(self, target, source=None):
+        """Path of the page target links to, or None."""
+        if target in self.targets:
+            path = self.targets[target]
+        else:
+            slug = slugify(target)
+            if slug not in self.cache:
+                found = self.joined.find(slug) if self.paths else -1
+                index = bisect_right(self.starts, found) - 1 if found >= 0 else len(self.paths)
+                index = min(index, self.by_title.get(slug, len(self.paths)))
+                self.cache[slug] = self.paths[index] if index < len(self.paths) else None
+            path = self.targets[target] = self.cache[slug]
+        if path is None and source is not None:
+            self.unresolved.setdefault(target, []).append(source)
+        return path
+
+def convert_wikilinks(content, resolver, base_path="", source=None):
     """Convert [[WikiLinks]] to HTML links."""
     def replace_link(match):
         link_text = match.group(1)
@@ -270,67 +332,52 @@ def convert_wikilinks(content, all_pages, base_path=""):
             target = display = link_text
         
         # Find matching page
-        slug = slugify(target)
-        for page_slug, page_title, page_path in all_pages:
-            if slug in page_slug or slugify(page_title) == slug:
-                return f'<a href="{base_path}{page_path}">{display}</a>'
+        page_path = resolver.resolve(target, source)
+        if page_path is not None:
+            return f'<a href="{base_path}{page_path}">{display}</a>'
         
         # No match found, return as plain text
         return display
     
-    return re.sub(r'\[\[([^\]]+)\]\]', replace_link, content)
+    return WIKILINK_RE.sub(replace_link, content)
 
 def markdown_to_html(content):
     """Simple markdown to HTML conversion."""
-    lines = content.split('\n')
     html_lines = []
     in_list = False
-    in_code = False
     in_table = False
     
-    for line in lines:
+    for line in tokenize(content):
         # Code blocks
-        if line.startswith('```'):
-            if in_code:
-                html_lines.append('</code></pre>')
-                in_code = False
-            else:
-                html_lines.append('<pre><code>')
-                in_code = True
+        if line.kind == 'fence':
+            html_lines.append('<pre><code>' if line.level else '</code></pre>')
             continue
         
-        if in_code:
-            html_lines.append(line)
+        if line.kind == 'code':
+            html_lines.append(line.raw)
             continue
         
         # Headers
-        if line.startswith('# '):
-            html_lines.append(f'<h1>{line[2:]}</h1>')
-            continue
-        elif line.startswith('## '):
-            html_lines.append(f'<h2>{line[3:]}</h2>')
-            continue
-        elif line.startswith('### '):
-            html_lines.append(f'<h3>{line[4:]}</h3>')
+        if line.kind == 'heading':
+            html_lines.append(f'<h{line.level}>{line.text}</h{line.level}>')
             continue
         
         # Blockquotes
-        if line.startswith('> '):
-            html_lines.append(f'<blockquote>{line[2:]}</blockquote>')
+        if line.kind == 'quote':
+            html_lines.append(f'<blockquote>{line.text}</blockquote>')
             continue
         
         # Tables
-        if '|' in line and line.strip().startswith('|'):
+        if line.kind in ('table_row', 'table_sep'):
             if not in_table:
                 html_lines.append('<table>')
                 in_table = True
             
-            if line.strip().replace('|', '').replace('-', '').strip() == '':
+            if line.kind == 'table_sep':
                 continue  # Skip separator line
             
-            cells = [c.strip() for c in line.split('|')[1:-1]]
             tag = 'th' if not any('<tr>' in l for l in html_lines[-5:] if '<tr>' in l) else 'td'
-            row = '<tr>' + ''.join(f'<{tag}>{c}</{tag}>' for c in cells) + '</tr>'
+            row = '<tr>' + ''.join(f'<{tag}>{c}</{tag}>' for c in line.cells) + '</tr>'
             html_lines.append(row)
             continue
         elif in_table:
@@ -338,30 +385,30 @@ def markdown_to_html(content):
             in_table = False
         
         # Lists
-        if line.strip().startswith('- ') or line.strip().startswith('* '):
+        if line.kind == 'bullet':
             if not in_list:
                 html_lines.append('<ul>')
                 in_list = True
-            html_lines.append(f'<li>{line.strip()[2:]}</li>')
+            html_lines.append(f'<li>{line.text}</li>')
             continue
-        elif line.strip() and line[0].isdigit() and '. ' in line[:4]:
+        elif line.kind == 'number':
             if not in_list:
                 html_lines.append('<ol>')
                 in_list = 'ol'
-            html_lines.append(f'<li>{line.split(". ", 1)[1]}</li>')
+            html_lines.append(f'<li>{line.text}</li>')
             continue
-        elif in_list and line.strip() == '':
+        elif in_list and line.kind == 'blank':
             html_lines.append('</ul>' if in_list == True else '</ol>')
             in_list = False
         
         # Bold and italic
-        line = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', line)
-        line = re.sub(r'\*([^*]+)\*', r'<em>\1</em>', line)
-        line = re.sub(r'`([^`]+)`', r'<code>\1</code>', line)
+        text = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', line.raw)
+        text = re.sub(r'\*([^*]+)\*', r'<em>\1</em>', text)
+        text = re.sub(r'`([^`]+)`', r'<code>\1</code>', text)
         
         # Paragraphs
-        if line.strip():
-            html_lines.append(f'<p>{line}</p>')
+        if text.strip():
+            html_lines.append(f'<p>{text}</p>')
         else:
             html_lines.append('')
     
@@ -374,6 +421,17 @@ def markdown_to_html(content):
 
 def build_sidebar(chapters_data, current_page=None, base_path=""):
     """Build sidebar navigation HTML."""
+    return mark_active(sidebar_template(chapters_data, base_path), current_page, base_path)
+
+def mark_active(sidebar, current_page, base_path=""):
+    """Mark current_page's link in a sidebar_template: one str.replace instead of a re-render."""
+    if current_page is None:
+        return sidebar
+    link = f'<a href="{base_path}{current_page}">'
+    return sidebar.replace(link, f'<a href="{base_path}{current_page}" class="active">', 1)
+
+def sidebar_template(chapters_data, base_path=""):
+    """Sidebar navigation HTML with no active link; render once per base_path."""
     html = ['<nav class="sidebar">']
     html.append('<h1>DatologyAI Wiki</h1>')
     html.append(f'<ul><li><a href="{base_path}index.html">Home</a></li></ul>')
@@ -382,15 +440,83 @@ def build_sidebar(chapters_data, current_page=None, base_path=""):
         html.append(f'<h2>{chapter_name}</h2>')
         html.append('<ul>')
         for slug, title, path in pages:
-            active = ' class="active"' if path == current_page else ''
-            html.append(f'<li><a href="{base_path}{path}"{active}>{title}</a></li>')
+            html.append(f'<li><a href="{base_path}{path}">{title}</a></li>')
         html.append('</ul>')
     
     html.append('</nav>')
     return '\n'.join(html)
 
-def build_page(title, content, sidebar, prev_page=None, next_page=None, base_path=""):
-    """Build complete HTML page."""
+NAV_SCRIPT = """(function () {
+  var script = document.currentScript, base = script.dataset.base, page = script.dataset.page;
+  var html = ['<h1>DatologyAI Wiki</h1>', '<ul><li><a href="' + base + 'index.html">Home</a></li></ul>'];
+  NAV.forEach(function (chapter) {
+    html.push('<h2>' + chapter.name + '</h2>', '<ul>');
+    chapter.pages.forEach(function (p) {
+      var active = p.path === page ? ' class="active"' : '';
+      html.push('<li><a href="' + base + p.path + '"' + active + '>' + p.title + '</a></li>');
+    });
+    html.push('</ul>');
+  });
+  script.insertAdjacentHTML('beforebegin', html.join('\\n'));
+})();
+"""
+
+def nav_data(chapters_data):
+    """The sidebar as data: [{"dir", "name", "pages": [{"slug", "title", "path"}]}]."""
+    return [{"dir": chapter_dir, "name": chapter_name,
+             "pages": [{"slug": slug, "title": title, "path": path} for slug, title, path in pages]}
+            for chapter_dir, chapter_name, pages in chapters_data]
+
+def write_shared_nav(chapters_data):
+    """
+    Write html/nav.json and html/assets/nav.js, which draws the sidebar in the
+    page, and return the script's path from the output root. The name is
+    stable so pages need not change when a title does.
+    """
+    data = json.dumps(nav_data(chapters_data), ensure_ascii=False)
+    ASSETS_DIR.mkdir(parents=True, exist_ok=True)
+    (OUTPUT_DIR / "nav.json").write_text(data)
+    (ASSETS_DIR / "nav.js").write_text(f"var NAV = {data};\n{NAV_SCRIPT}")
+    return "assets/nav.js"
+
+def shared_sidebar(nav_script, current_page=None, base_path=""):
+    """Sidebar placeholder that nav.js fills in client-side."""
+    return (f'<nav class="sidebar"><script src="{base_path}{nav_script}" '
+            f'data-base="{base_path}" data-page="{current_page or ""}"></script></nav>')
+
+CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_STRING_RE = re.compile(r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')')
+CSS_SPACE_RE = re.compile(r'\s+')
+CSS_PUNCT_RE = re.compile(r'\s*([{};,>])\s*|(:)\s+')   # not " :" — that space is a descendant combinator
+
+def minify_css(css):
+    """Drop comments and needless whitespace (quoted strings are left alone)."""
+    parts = CSS_STRING_RE.split(CSS_COMMENT_RE.sub('', css))
+    for i in range(0, len(parts), 2):  # odd indexes are the quoted strings
+        text = CSS_PUNCT_RE.sub(lambda m: m.group(1) or m.group(2), CSS_SPACE_RE.sub(' ', parts[i]))
+        parts[i] = text.replace(';}', '}')
+    return ''.join(parts).strip()
+
+def write_stylesheet(css, minify=False):
+    """
+    Write css to html/assets/wiki.<hash>.css (a new name whenever the
+    content changes, so it can be cached forever) and return its path
+    relative to the output root. Older wiki.*.css files are removed.
+    """
+    if minify:
+        css = minify_css(css)
+    name = f"wiki.{hashlib.sha256(css.encode('utf-8')).hexdigest()[:12]}.css"
+    ASSETS_DIR.mkdir(parents=True, exist_ok=True)
+    path = ASSETS_DIR / name
+    if not path.exists():
+        path.write_text(css)
+    for old in ASSETS_DIR.glob("wiki.*.css"):
+        if old.name != name:
+            old.unlink()
+    return f"assets/{name}"
+
+def build_page(title, content, sidebar, prev_page=None, next_page=None, base_path="", stylesheet=None):
+    """Build complete HTML page; stylesheet is a path from the output root, else the CSS is inlined."""
     nav = '<div class="page-nav">'
     if prev_page:
         nav += f'<a href="{base_path}{prev_page[1]}">← {prev_page[0]}</a>'
@@ -408,7 +534,7 @@ def build_page(title, content, sidebar, prev_page=None, next_page=None, base_pat
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>{title} | DatologyAI Wiki</title>
-    <style>{CSS}</style>
+    {f'<link rel="stylesheet" href="{base_path}{stylesheet}">' if stylesheet else f'<style>{CSS}</style>'}
 </head>
 <body>
 {sidebar}
@@ -419,13 +545,122 @@ def build_page(title, content, sidebar, prev_page=None, next_page=None, base_pat
 </body>
 </html>"""
 
+def _sha(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def build_version():
+    """Hash of the converter itself: editing the templates, CSS or tokenizer rebuilds every page."""
+    sources = [Path(__file__), Path(__file__).with_name("markdown_blocks.py")]
+    return _sha(''.join(p.read_text() for p in sources if p.exists()))
+
+def load_build_cache(version):
+    """Last build's page records ({md path: entry}), or {} if missing, unreadable or from another version."""
+    try:
+        cache = json.loads(BUILD_CACHE_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
+    return cache.get("pages", {}) if cache.get("version") == version else {}
+
+def scan_page(md_file, cached):
+    """
+    Page record for md_file: stat, source hash, title and wikilink targets.
+    The file is only read if its size or mtime changed since `cached`;
+    returns (entry, content or None).
+    """
+    st = md_file.stat()
+    if cached and cached["mtime_ns"] == st.st_mtime_ns and cached["size"] == st.st_size:
+        return cached, None
+    with open(md_file) as f:
+        content = f.read()
+    
+    # Extract title from first H1
+    title_match = TITLE_RE.search(content)
+    entry = {
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "hash": _sha(content),
+        "title": title_match.group(1) if title_match else md_file.stem,
+        "links": [link.split('|', 1)[0] for link in WIKILINK_RE.findall(content)],
+    }
+    if cached and cached["hash"] == entry["hash"]:
+        entry["key"] = cached.get("key")  # touched, not edited
+    return entry, content
+
+# Read-only page index for render_page, set once per process by init_renderer
+_RENDER = {}
+
+def init_renderer(chapters_data, all_pages, stylesheet=None, nav_script=None):
+    """Give this process (the main one, or a pool worker) the page index and sidebar."""
+    _RENDER["resolver"] = LinkResolver(all_pages)
+    _RENDER["nav_script"] = nav_script
+    _RENDER["sidebar"] = None if nav_script else sidebar_template(chapters_data, base_path="../")
+    _RENDER["stylesheet"] = stylesheet
+
+def render_page(job):
+    """Convert one chapter page and write it; job is (html_path, title, prev, next, md_file, content or None)."""
+    html_path, title, prev_page, next_page, md_file, content = job
+    if content is None:
+        with open(md_file) as f:
+            content = f.read()
+    
+    # Convert wikilinks and markdown (chapter pages need ../ prefix)
+    content = convert_wikilinks(content, _RENDER["resolver"], base_path="../")
+    html_content = markdown_to_html(content)
+    
+    # Build sidebar (chapter pages need ../ prefix for links)
+    if _RENDER["nav_script"]:
+        sidebar = shared_sidebar(_RENDER["nav_script"], html_path, base_path="../")
+    else:
+        sidebar = mark_active(_RENDER["sidebar"], html_path, base_path="../")
+    
+    # Build complete page
+    page_html = build_page(title, html_content, sidebar, prev_page, next_page, base_path="../",
+                           stylesheet=_RENDER["stylesheet"])
+    
+    # Write file
+    with open(OUTPUT_DIR / html_path, 'w') as f:
+        f.write(page_html)
+    return html_path
+
+def render_pages(jobs, chapters_data, all_pages, workers=1, stylesheet=None, nav_script=None):
+    """Render jobs serially or on a process pool; yields html paths in job order either way."""
+    if workers <= 1 or len(jobs) < 2:
+        init_renderer(chapters_data, all_pages, stylesheet, nav_script)
+        yield from map(render_page, jobs)
+        return
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_renderer,
+                             initargs=(chapters_data, all_pages, stylesheet, nav_script)) as pool:
+        yield from pool.map(render_page, jobs, chunksize=chunksize)
+
 def main():
+    parser = argparse.ArgumentParser(description="Build the wiki's HTML from chapters/*.md")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild every page, ignoring html/.build_cache.json")
+    parser.add_argument("--jobs", "-j", type=int, default=1, metavar="N",
+                        help="Render pages in N processes (0 = one per CPU; default 1). "
+                             "Output is identical to a serial build")
+    parser.add_argument("--css", type=Path, metavar="FILE",
+                        help="Stylesheet to publish instead of the built-in one (e.g. book/assets/wiki-dark.css)")
+    parser.add_argument("--minify-css", action="store_true",
+                        help="Minify the published stylesheet")
+    parser.add_argument("--shared-nav", action="store_true",
+                        help="Draw the sidebar client-side from html/assets/nav.js (+ nav.json) instead of "
+                             "embedding it in every page; needs JavaScript")
+    args = parser.parse_args()
+    
     # Create output directory
     OUTPUT_DIR.mkdir(exist_ok=True)
+    version = build_version()
+    css = args.css.read_text() if args.css else CSS
+    stylesheet = write_stylesheet(css, minify=args.minify_css)
+    cache = {} if args.force else load_build_cache(version)
     
-    # Collect all pages
+    # Collect all pages (each file is read at most once, and only if it changed)
     chapters_data = []
     all_pages = []
+    entries = {}
+    contents = {}
     
     for chapter_dir, chapter_name in CHAPTERS:
         chapter_path = CHAPTERS_DIR / chapter_dir
@@ -434,52 +669,61 @@ def main():
         
         pages = []
         for md_file in sorted(chapter_path.glob("*.md")):
-            with open(md_file) as f:
-                content = f.read()
-            
-            # Extract title from first H1
-            title_match = re.search(r'^# (.+)$', content, re.MULTILINE)
-            title = title_match.group(1) if title_match else md_file.stem
-            
             slug = md_file.stem
             html_path = f"{chapter_dir}/{slug}.html"
-            pages.append((slug, title, html_path))
-            all_pages.append((slug, title, html_path))
+            entry, content = scan_page(md_file, cache.get(html_path))
+            entries[html_path] = entry
+            if content is not None:
+                contents[html_path] = content
+            
+            pages.append((slug, entry["title"], html_path))
+            all_pages.append((slug, entry["title"], html_path))
         
         chapters_data.append((chapter_dir, chapter_name, pages))
     
-    # Convert all pages
+    # Every page's sidebar lists every title, so it is one signature for all
+    # (with --shared-nav the sidebar lives in nav.js, and pages do not depend on it)
+    nav_script = write_shared_nav(chapters_data) if args.shared_nav else None
+    if not nav_script:
+        (OUTPUT_DIR / "nav.json").unlink(missing_ok=True)
+        (ASSETS_DIR / "nav.js").unlink(missing_ok=True)
+    sidebar_sig = nav_script or _sha(json.dumps(chapters_data))
+    
+    # Convert changed pages: a page is rebuilt when its source, its title,
+    # a neighbour's title, where its links resolve, or the sidebar changed
+    resolver = LinkResolver(all_pages)
+    jobs = []
     for i, (chapter_dir, chapter_name, pages) in enumerate(chapters_data):
         chapter_path = CHAPTERS_DIR / chapter_dir
         output_chapter = OUTPUT_DIR / chapter_dir
         output_chapter.mkdir(exist_ok=True)
         
         for j, (slug, title, html_path) in enumerate(pages):
-            md_file = chapter_path / f"{slug}.md"
-            with open(md_file) as f:
-                content = f.read()
-            
-            # Convert wikilinks and markdown (chapter pages need ../ prefix)
-            content = convert_wikilinks(content, all_pages, base_path="../")
-            html_content = markdown_to_html(content)
-            
             # Build navigation
             flat_idx = sum(len(c[2]) for c in chapters_data[:i]) + j
             prev_page = all_pages[flat_idx - 1][1:] if flat_idx > 0 else None
             next_page = all_pages[flat_idx + 1][1:] if flat_idx < len(all_pages) - 1 else None
             
-            # Build sidebar (chapter pages need ../ prefix for links)
-            sidebar = build_sidebar(chapters_data, html_path, base_path="../")
-            
-            # Build complete page
-            page_html = build_page(title, html_content, sidebar, prev_page, next_page, base_path="../")
-            
-            # Write file
-            output_file = OUTPUT_DIR / html_path
-            with open(output_file, 'w') as f:
-                f.write(page_html)
-            
-            print(f"✓ {html_path}")
+            entry = entries[html_path]
+            links = [resolver.resolve(target, source=html_path) for target in entry["links"]]
+            key = _sha(json.dumps([version, entry["hash"], title, prev_page, next_page, links, sidebar_sig, stylesheet]))
+            if entry.get("key") == key and (OUTPUT_DIR / html_path).exists():
+                continue
+            entry["key"] = key
+            jobs.append((html_path, title, prev_page, next_page, chapter_path / f"{slug}.md", contents.get(html_path)))
+    
+    workers = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    for html_path in render_pages(jobs, chapters_data, all_pages, workers, stylesheet, nav_script):
+        print(f"✓ {html_path}")
+    rebuilt = len(jobs)
+    
+    # Pages whose Markdown is gone
+    for html_path in cache.keys() - entries.keys():
+        (OUTPUT_DIR / html_path).unlink(missing_ok=True)
+        print(f"✗ {html_path} (source removed)")
+    
+    with open(BUILD_CACHE_FILE, 'w') as f:
+        f.write(json.dumps({"version": version, "pages": entries}))
     
     # Create index page
     index_content = f"""<h1>DatologyAI Educational Wiki</h1>
@@ -518,14 +762,23 @@ Generated {datetime.now().strftime('%Y-%m-%d')} • 64 pages • ~87,000 words
 </p>
 """
     
-    sidebar = build_sidebar(chapters_data)
-    index_html = build_page("Home", index_content, sidebar, 
+    sidebar = shared_sidebar(nav_script) if nav_script else build_sidebar(chapters_data)
+    index_html = build_page("Home", index_content, sidebar, stylesheet=stylesheet,
                            next_page=all_pages[0][1:] if all_pages else None)
     
     with open(OUTPUT_DIR / "index.html", 'w') as f:
         f.write(index_html)
     
-    print(f"\n✅ Wiki built: {len(all_pages)} pages in {OUTPUT_DIR}")
+    if resolver.unresolved:
+        print(f"\n⚠️  {len(resolver.unresolved)} unresolved wikilink target(s) (left as plain text):")
+        for target, sources in sorted(resolver.unresolved.items())[:20]:
+            more = f" (+{len(sources) - 1} more)" if len(sources) > 1 else ""
+            print(f"   [[{target}]] in {sources[0]}{more}")
+        if len(resolver.unresolved) > 20:
+            print(f"   … and {len(resolver.unresolved) - 20} more")
+    
+    print(f"\n✅ Wiki built: {len(all_pages)} pages in {OUTPUT_DIR} "
+          f"({rebuilt} rebuilt, {len(all_pages) - rebuilt} unchanged)")
     print(f"   Open {OUTPUT_DIR}/index.html to view")
 
 if __name__ == "__main__":
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Offline check of the Ollama backend and LLMDispatcher against a local stub.
+
+Starts an http.server stub of Ollama's /api/generate on a free port and runs
+call_llm / call_llm_stream through OllamaBackend and a fresh LLMDispatcher
+(LLM cache off), checking:
+  keep-alive     each worker thread reuses one HTTP connection across calls
+  retry-after    a 429 with Retry-After pauses every thread, then all succeed
+  concurrency    repeated 429s halve the concurrency limit, which recovers
+  400            a non-retryable error is raised after a single request
+
+    python3 check_llm_dispatch.py
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import book_builder as bb
+
+
+class Stub:
+    """Server-side counters and a scripted queue of error responses (status, headers) to send first."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, errors=(), delay=0.02):
+        with self.lock:
+            self.errors      = list(errors)
+            self.delay       = delay
+            self.requests    = 0
+            self.connections = 0
+            self.times       = []   # arrival time of each request
+
+
+STUB = Stub()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+
+    def setup(self):
+        super().setup()
+        with STUB.lock:
+            STUB.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=()):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        for name, value in [("Content-Length", str(len(data))), *headers]:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with STUB.lock:
+            STUB.requests += 1
+            STUB.times.append(time.monotonic())
+            error = STUB.errors.pop(0) if STUB.errors else None
+        time.sleep(STUB.delay)
+        if error:
+            status, headers = error
+            self._send(status, json.dumps({"error": f"stub {status}"}), headers)
+        elif payload["stream"]:
+            words = f"echo: {payload['prompt']}".split(" ")
+            events = [{"response": w + " ", "done": False} for w in words]
+            events.append({"response": "", "done": True, "prompt_eval_count": 3, "eval_count": len(words)})
+            self._send(200, "".join(json.dumps(e) + "\n" for e in events))
+        else:
+            self._send(200, json.dumps({"response": f"echo: {payload['prompt']}", "done": True,
+                                        "prompt_eval_count": 3, "eval_count": 2}))
+
+
+def run_calls(n, workers, stream=False):
+    """n distinct prompts over `workers` threads; returns the responses in order."""
+    def call(i):
+        prompt = f"prompt {i} {time.monotonic_ns()}"
+        if stream:
+            return prompt, bb.call_llm_stream(prompt, lambda label, content: None, task="check")
+        return prompt, bb.call_llm(prompt, task="check")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(call, range(n)))
+    for prompt, text in results:
+        assert text.strip() == f"echo: {prompt}", (prompt, text)
+    return results
+
+
+def fresh_dispatcher(max_concurrency):
+    dispatcher = bb.LLMDispatcher(max_concurrency=max_concurrency, base_delay=0.05, max_delay=0.2)
+    bb.set_llm_dispatcher(dispatcher)
+    return dispatcher
+
+
+def check_keep_alive(host):
+    for stream in (False, True):
+        STUB.reset()
+        bb.set_llm_backend(bb.OllamaBackend(host=host))   # new backend: no connections yet
+        fresh_dispatcher(4)
+        run_calls(40, workers=4, stream=stream)
+        assert STUB.requests == 40, STUB.requests
+        assert STUB.connections <= 4, f"{STUB.connections} connections for 4 threads"
+        print(f"  ✓ keep-alive ({'stream' if stream else 'complete'}): 40 calls, 4 threads, "
+              f"{STUB.connections} connection(s)")
+
+
+def check_retry_after():
+    STUB.reset(errors=[(429, [("Retry-After", "0.5")])])
+    dispatcher = fresh_dispatcher(4)
+    start = time.monotonic()
+    run_calls(8, workers=4)
+    assert dispatcher.retries == 1 and dispatcher.throttled == 1, dispatcher.summary()
+    first_error = STUB.times[0]
+    later = [t for t in STUB.times[1:] if t - first_error > 0.05]   # not already in flight with it
+    assert later and min(later) - first_error >= 0.45, "requests were sent during the Retry-After pause"
+    print(f"  ✓ retry-after: 429 with Retry-After 0.5s paused all threads, {STUB.requests} requests, "
+          f"{time.monotonic() - start:.2f}s")
+
+
+def check_concurrency():
+    STUB.reset(errors=[(429, [])] * 6, delay=0.05)
+    dispatcher = fresh_dispatcher(8)
+    run_calls(64, workers=8)
+    limit = dispatcher.limit
+    assert limit.lowest < limit.maximum, dispatcher.summary()
+    assert dispatcher.throttled == 6, dispatcher.summary()
+    print(f"  ✓ concurrency: 6× 429 lowered the limit {limit.maximum} → {limit.lowest}, "
+          f"back to {limit.limit} after {STUB.requests} requests")
+
+
+def check_non_retryable():
+    STUB.reset(errors=[(400, [])])
+    dispatcher = fresh_dispatcher(4)
+    try:
+        bb.call_llm("bad request", task="check")
+    except bb.LLMHTTPError as e:
+        assert e.status_code == 400
+    else:
+        raise AssertionError("400 did not raise")
+    assert STUB.requests == 1 and dispatcher.retries == 0, (STUB.requests, dispatcher.summary())
+    print("  ✓ 400: raised LLMHTTPError after 1 request, no retries")
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = f"127.0.0.1:{server.server_address[1]}"
+    print(f"Ollama stub on {host}")
+
+    bb.LLM_CACHE.mode = "off"
+    try:
+        check_keep_alive(host)
+        bb.set_llm_backend(bb.OllamaBackend(host=host))
+        check_retry_after()
+        check_concurrency()
+        check_non_retryable()
+    finally:
+        server.shutdown()
+    print("All checks passed")
+
+
+if __name__ == "__main__":
+    main()
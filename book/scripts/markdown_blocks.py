@@ -0,0 +1,50 @@
+"""
+Line-level Markdown tokenizer shared by build-html.py and book_builder.py.
+
+Each line is classified exactly the way build-html's converter always has:
+``` fences toggle code, `# ` / `## ` / `### ` headings at column 0,
+single-line `> ` quotes, `|` table rows, `- ` / `* ` / `1. ` list items.
+Renderers (HTML, Typst, Quarto) only decide what to emit for each line.
+"""
+
+from typing import Iterator, NamedTuple
+
+HEADINGS = (("# ", 1), ("## ", 2), ("### ", 3))
+
+
+class Line(NamedTuple):
+    kind: str           # fence | code | heading | quote | table_sep | table_row | bullet | number | blank | text
+    text: str           # heading/quote/item text, fence info string, else the line itself
+    raw: str            # the original line
+    level: int = 0      # heading level; list item indent; 1 for an opening fence, 0 for a closing one
+    cells: tuple = ()   # table_row cells, stripped
+
+
+def tokenize(content: str) -> Iterator[Line]:
+    """Classify every line of content (split on "\\n") in order."""
+    in_code = False
+    for line in content.split("\n"):
+        stripped = line.strip()
+        if line.startswith("```"):
+            in_code = not in_code
+            yield Line("fence", line[3:].strip() if in_code else "", line, int(in_code))
+        elif in_code:
+            yield Line("code", line, line)
+        elif heading := next(((level, prefix) for prefix, level in HEADINGS if line.startswith(prefix)), None):
+            level, prefix = heading
+            yield Line("heading", line[len(prefix):], line, level)
+        elif line.startswith("> "):
+            yield Line("quote", line[2:], line)
+        elif "|" in line and stripped.startswith("|"):
+            if stripped.replace("|", "").replace("-", "").strip() == "":
+                yield Line("table_sep", line, line)
+            else:
+                yield Line("table_row", line, line, cells=tuple(c.strip() for c in line.split("|")[1:-1]))
+        elif stripped.startswith("- ") or stripped.startswith("* "):
+            yield Line("bullet", stripped[2:], line, len(line) - len(line.lstrip()))
+        elif stripped and line[0].isdigit() and ". " in line[:4]:
+            yield Line("number", line.split(". ", 1)[1], line)
+        elif not stripped:
+            yield Line("blank", line, line)
+        else:
+            yield Line("text", line, line)